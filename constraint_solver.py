@@ -4,10 +4,14 @@ from ulf_grammar import *
 import numpy as np
 import math
 from entity import Entity
+import query_plan
 
 global_entities = []
 world = None
 
+#Print the plan of every query before executing it (see query_plan.QueryPlan.explain)
+debug_plans = False
+
 def ident(arg1, arg2):
 	return int(arg1 is arg2)
 
@@ -183,6 +187,24 @@ arity = {
 	green:1
     }
 
+def evaluate(predicate, *args):
+	"""
+	Compute the value of the predicate for the given arguments. The values
+	of binary spatial relations are read from the relation matrices of the world,
+	and all the values are memoized until the world changes (see relation_memo.py).
+
+	"""
+	memo = getattr(world, 'memo', None)
+	if memo is not None:
+		return memo.get(predicate, args, lambda: compute_value(predicate, *args))
+	return compute_value(predicate, *args)
+
+def compute_value(predicate, *args):
+	relations = getattr(world, 'relations', None)
+	if relations is not None and len(args) == 2 and relations.supports(predicate):
+		return relations.value(predicate, *args)
+	return predicate(*args)
+
 #Returns the sublist of the entity list having the specified color
 def filter_by_color(entities, color):
 	ret_val = [] if entities == [] or entities is None \
@@ -202,43 +224,85 @@ def filter_by_name(entities, name):
 			else [entity for entity in entities if entity.type_structure[-1].lower().replace("'", "") == name.lower().replace("'", "")]
 	return ret_val
 	
-#Returns the list of pairs (relatum, referent) such that the given relation holds
-#between them (above the threshold)
-def filter_relation_by_threshold(relatums, relation, referents, threshold):
-        ret_val = []
-        for rel in relatums:
-                for ref in referents:
-                        if relation(rel, ref) >= threshold:
-                                ret_val += [(rel, ref)]
-        return ret_val
-
-def filter_by_relation(relatums, relation, referents, modifier=None):
-	ret_val = []
-	if modifier in ['fully.adv-a', 'directly.adv-a', 'very.adv-a', 'fully.mod-a', 'directly.mod-a', 'very.mod-a']:
-		return filter_relation_by_threshold(relatums, relation, referents, 0.9)
-	elif modifier in ['slightly.adv-a', 'slightly.mod-a', 'marginally.adv-a']:
-		return filter_relation_by_threshold(relatums, relation, referents, 0.5)
-	elif modifier in ['halfway.adv-a', 'halfway.mod-a']:
-		return filter_relation_by_threshold(relatums, relation, referents, 0.7)
-	else:
-		return filter_relation_by_threshold(relatums, relation, referents, 0.5)
-
-def form_arg_tuples(args, arity):	
-	cert_dict = {}
-	for item in args:
-		cert_dict[item[0]] = item[1]
-	bare_args = [item[0] for item in args]	
-	tuples = list(itertools.combinations(bare_args, arity))
-	ret_val = [(tup, np.average([cert_dict[item] for item in tup])) for tup in tuples]	
-	return ret_val
+#Maximum number of argument tuples examined for a numeral, e.g., "four blocks"
+MAX_ARG_TUPLES = 50000
 
-def filter_by_numeral(numeral, entities):
+class ArgTuples(object):
 	"""
-	Return the list of tuples of entities
-	determined by the numeral.
+	Lazy sequence of the tuples of arguments formed from the combinations of the
+	(argument, certainty) pairs, paired with their average certainty.
+
+	The tuples are generated anew on each iteration instead of being stored, and
+	at most limit tuples are produced, so that the numerals over large scenes
+	do not build C(N, k) tuples in memory. The combinations are produced in
+	lexicographic order, so a truncated sequence leaves out the tuples led by
+	the last arguments altogether (see truncated).
 
 	"""
-	#print ("NUMERAL: ", numeral)
+	def __init__(self, args, arity, limit=MAX_ARG_TUPLES):
+		self.args = list(args)
+		self.arity = arity
+		self.limit = limit
+		self.cert_dict = {}
+		for item in self.args:
+			self.cert_dict[item[0]] = item[1]
+		self.bare_args = [item[0] for item in self.args]
+
+	def pair(self, tup):
+		return (tup, np.average([self.cert_dict[item] for item in tup]))
+
+	def __iter__(self):
+		tuples = itertools.combinations(self.bare_args, self.arity)
+		if self.limit is not None:
+			tuples = itertools.islice(tuples, self.limit)
+		for tup in tuples:
+			yield self.pair(tup)
+
+	def __len__(self):
+		count = math.comb(len(self.bare_args), self.arity)
+		return count if self.limit is None else min(count, self.limit)
+
+	def __getitem__(self, index):
+		if index < 0:
+			index += len(self)
+		if index < 0 or index >= len(self):
+			raise IndexError("argument tuple index out of range")
+		#Pick the arguments of the tuple in turn, skipping the combinations led by each argument before it
+		tup = []
+		start = 0
+		for k in range(self.arity, 0, -1):
+			for i in range(start, len(self.bare_args)):
+				count = math.comb(len(self.bare_args) - i - 1, k - 1)
+				if index < count:
+					tup.append(self.bare_args[i])
+					start = i + 1
+					break
+				index -= count
+		return self.pair(tuple(tup))
+
+	@property
+	def entities(self):
+		"""The entities occurring in the tuples, in their order."""
+		ret_val = {}
+		for arg in self.bare_args:
+			for item in (arg if type(arg) == tuple else (arg,)):
+				ret_val[item] = None
+		return list(ret_val)
+
+	def truncated(self):
+		"""Check whether the limit leaves some of the tuples out."""
+		return self.limit is not None and math.comb(len(self.bare_args), self.arity) > self.limit
+
+	def unlimited(self):
+		"""Return the sequence of all the tuples, without the limit."""
+		return ArgTuples(self.args, self.arity, limit=None)
+
+	def first_arguments(self):
+		"""Return the number of distinct arguments that can come first in a tuple."""
+		return len(set(self.bare_args[:max(len(self.bare_args) - self.arity + 1, 0)]))
+
+def numeral_arity(numeral):
+	"""Return the number of entities in the tuples determined by the numeral."""
 	num = 1
 	if numeral.content == "two.d" or numeral.content == "two.a":
 		num = 2
@@ -246,10 +310,18 @@ def filter_by_numeral(numeral, entities):
 		num = 3
 	elif numeral.content == "four.d" or numeral.content == "four.a":
 		num = 4
+	return num
 
+def filter_by_numeral(numeral, entities, limit=MAX_ARG_TUPLES):
+	"""
+	Return the lazy sequence of at most limit (all if None) tuples
+	of entities determined by the numeral (see ArgTuples).
+
+	"""
+	#print ("NUMERAL: ", numeral)
 	# ret_val = list(itertools.combinations(entities, num))
 	# ret_val = [(arg, 1.0) for arg in ret_val]
-	ret_val = form_arg_tuples(entities, num)
+	ret_val = ArgTuples(entities, numeral_arity(numeral), limit)
 
 	return ret_val
 
@@ -262,6 +334,153 @@ def filter_by_determiner(entities, modifier):
 	#print ("DET PROCESSING: ", ret_val)
 	return ret_val
 
+def arg_entities(args):
+	"""Return the entities occurring in the (argument, certainty) pairs, in their order."""
+	if isinstance(args, ArgTuples):
+		return args.entities
+	ret_val = {}
+	for arg in args:
+		for item in (arg[0] if type(arg[0]) == tuple else (arg[0],)):
+			ret_val[item] = None
+	return list(ret_val)
+
+class BlockValues(object):
+	"""
+	Values of a relation read in one block for the first arguments (the rows) and
+	the rest of the arguments (the columns), looked up by the tuple of arguments.
+
+	"""
+	def __init__(self, block, rows, columns):
+		self.block = block
+		self.rows = {item: i for i, item in enumerate(rows)}
+		self.columns = {item: j for j, item in enumerate(columns)}
+
+	@staticmethod
+	def column(arg):
+		return arg[1] if len(arg) == 2 else tuple(arg[1:])
+
+	def __contains__(self, arg):
+		return arg[0] in self.rows and self.column(arg) in self.columns
+
+	def __getitem__(self, arg):
+		return float(self.block[self.rows[arg[0]], self.columns[self.column(arg)]])
+
+	def __len__(self):
+		return len(self.rows) * len(self.columns)
+
+	def get(self, arg, default=None):
+		return self[arg] if arg in self else default
+
+def pair_block(read, relata, referents):
+	"""
+	Read the values of read(I, J) for the block of pairs of the entities of the
+	relata and of the referents at once.
+
+	Return:
+	The BlockValues of the pairs (arg0, arg1)
+
+	"""
+	index = world.relations.refresh().index
+	first = [item for item in arg_entities(relata) if item in index]
+	second = [item for item in arg_entities(referents) if item in index]
+	block = read([index[item] for item in first], [index[item] for item in second])
+	return BlockValues(block, first, second)
+
+def triple_block(predicate, relata, referents):
+	"""
+	Read the values of a ternary relation for the entities of the relata and
+	all the pairs formed from each tuple of referents at once.
+
+	Return:
+	The BlockValues of the triples (arg0, arg1, arg2)
+
+	"""
+	relations = world.relations
+	index = relations.refresh().index
+	first = [item for item in arg_entities(relata) if item in index]
+	pairs = {}
+	for ref in referents:
+		if type(ref[0]) == tuple:
+			for pair in itertools.combinations(ref[0], 2):
+				if pair[0] in index and pair[1] in index:
+					pairs[pair] = None
+	pairs = list(pairs)
+	block = relations.triples(predicate, [index[item] for item in first],
+							  [(index[b], index[c]) for (b, c) in pairs])
+	return BlockValues(block, first, pairs)
+
+def prefetch(predicate, relata, referents):
+	"""
+	Read the values of a binary relation batched by the relation engine for all the pairs
+	of the relata and the referents in one block, instead of computing the full matrix.
+	The values of a ternary relation (between) are read for all the relata and the
+	pairs of referents in one block in the same way.
+
+	Return:
+	The BlockValues of the argument tuples, or an empty dictionary
+
+	"""
+	relations = getattr(world, 'relations', None)
+	if relations is None or not relata or not referents:
+		return {}
+	if arity.get(predicate) == 3 and predicate in relations.ternary:
+		return triple_block(predicate, relata, referents)
+	if arity.get(predicate) != 2 or not relations.batched(predicate):
+		return {}
+	return pair_block(lambda I, J: relations.block(predicate, I, J), relata, referents)
+
+def upper_bounds(predicate, relata, referents):
+	"""
+	Read the upper bounds on the values of a binary relation that is evaluated
+	pair by pair, for all the pairs of the relata and the referents.
+
+	Return:
+	The BlockValues of the bounds on the values of the relation, or an empty dictionary
+
+	"""
+	relations = getattr(world, 'relations', None)
+	if relations is None or arity.get(predicate) != 2 or not relations.bounded(predicate) or not relata or not referents:
+		return {}
+	return pair_block(lambda I, J: relations.upper_bound(predicate, I, J), relata, referents)
+
+def modifier_threshold(modifier):
+	"""
+	Return the threshold that filter_by_predicate_modifier applies for the modifier,
+	or None if the modifier does not just keep the values above a threshold.
+
+	"""
+	if modifier.content is not None and modifier.content != "":
+		modifier = modifier.content
+	if modifier in ['fully.adv-a', 'directly.adv-a', 'very.adv-a', 'fully.mod-a', 'directly.mod-a', 'very.mod-a']:
+		return 0.9
+	elif modifier in ['slightly.adv-a', 'slightly.mod-a', 'marginally.adv-a']:
+		return 0.5
+	elif modifier in ['halfway.adv-a', 'halfway.mod-a']:
+		return 0.8
+	elif type(modifier) == TNeg or modifier in ['not.adv-s', 'not.adv-a', 'not.mod-a'] or type(modifier) == TSuperMarker:
+		return None
+	return 0.7
+
+def selection_cutoff(modifiers, unique):
+	"""
+	Determine which predicate values can be left out of the result of compute_predicate
+	without changing the outcome of the modifiers of the predicate.
+
+	Return:
+	The pair (threshold, superlative): the values below the threshold are discarded by
+	the modifiers, or, for a superlative, only the two best values are looked at.
+	(None, False) if all the values are needed.
+
+	"""
+	if modifiers is None or modifiers == []:
+		return (None, True) if unique else (0.7, False)
+	if len(modifiers) == 1 and type(modifiers[0]) == TSuperMarker:
+		return None, True
+	thresholds = [modifier_threshold(modifier) for modifier in modifiers]
+	if None in thresholds:
+		return None, False
+	return max(thresholds), False
+
 # def compute_predicate(predicate, *arglists):	
 # 	arg_combinations = list(itertools.product(*arglists))	
 # 	print ("ARG_LISTS: ", arglists, *arglists, arg_combinations)
@@ -270,58 +489,102 @@ def filter_by_determiner(entities, modifier):
 # 	predicate_values = [(arg, predicate(*arg)) for arg in arg_combinations]	
 # 	return predicate_values
 
-def compute_predicate(predicate, relata, referents):
+def compute_predicate(predicate, relata, referents, threshold=None, superlative=False, witnesses=None):
 	"""
 	Compute the values of the specified predicate for each combination of 
 	arg0, arg1.
 
+	The combinations are formed lazily, so that the relata can be a stream of
+	argument tuples (see ArgTuples). Given a threshold, only the values above it
+	are kept, and the combinations whose upper bound (if the relation engine bounds
+	the predicate) is below it are left out. Given a number of witnesses, the
+	evaluation stops as soon as that many distinct arg0 pass the threshold.
+	For a superlative, the combinations are evaluated from the highest bound down,
+	leaving out those that cannot beat the second best value (see selection_cutoff).
+
 	Return:
 	The list of tuples of the form ((arg0, arg1), predicate_value),
 	where predicate_value is the value for that pair od arguments
 
 	"""
-	predicate_values = []
+	values = prefetch(predicate, relata, referents)
+	bounds = upper_bounds(predicate, relata, referents) if threshold is not None or superlative else {}
 	#print("\n\n\n")
 	#print ("RELATA: ", relata)
 	#print ("\nREFS: ", referents)
 
-	for rel in relata:
-		if type(rel[0]) != tuple:
-			rel = ((rel[0],), rel[1])
-		rel_tuples = list(itertools.combinations(rel[0], r = 1))
-		rel_cert = rel[1]
-		if referents is not None and referents != []:
-			for ref in referents:				
-				if type(ref[0]) != tuple:
-					ref = ((ref[0],), ref[1])
-
-				if predicate != ident and len(set(rel[0]).intersection(set(ref[0]))) > 0:					
-					#print ("INTERSECT: ", rel, ref)
-					if len(ref[0]) < 5:
-						continue
+	def entries():
+		for rel in relata:
+			if type(rel[0]) != tuple:
+				rel = ((rel[0],), rel[1])
+			rel_tuples = list(itertools.combinations(rel[0], r = 1))
+			rel_cert = rel[1]
+			if referents is not None and len(referents) > 0:
+				for ref in referents:				
+					if type(ref[0]) != tuple:
+						ref = ((ref[0],), ref[1])
+
+					if predicate != ident and len(set(rel[0]).intersection(set(ref[0]))) > 0:					
+						#print ("INTERSECT: ", rel, ref)
+						if len(ref[0]) < 5:
+							continue
+						else:
+							filtered = tuple([item for item in ref[0] if item not in rel[0]])
+							#print ("FILTERED: ", filtered)
+							ref = (filtered, ref[1])
+					ref_tuples = list(itertools.combinations(ref[0], r = arity[predicate] - 1))
+					ref_cert = ref[1]
+					#print ("REL TUPLES: ", rel_tuples)
+					#print ("REF TUPLES: ", ref_tuples)
+					arg_combinations = list(itertools.product(rel_tuples, ref_tuples))
+					#print ("ARG_COMBINATIONS: ", arg_combinations)
+					if predicate != ident:
+						arg_combinations = [(*arg0, *arg1) for (arg0, arg1) in arg_combinations if arg0[0] not in arg1]
 					else:
-						filtered = tuple([item for item in ref[0] if item not in rel[0]])
-						#print ("FILTERED: ", filtered)
-						ref = (filtered, ref[1])
-				ref_tuples = list(itertools.combinations(ref[0], r = arity[predicate] - 1))
-				ref_cert = ref[1]
-				#print ("REL TUPLES: ", rel_tuples)
-				#print ("REF TUPLES: ", ref_tuples)
-				arg_combinations = list(itertools.product(rel_tuples, ref_tuples))
-				#print ("ARG_COMBINATIONS: ", arg_combinations)
-				if predicate != ident:
-					arg_combinations = [(*arg0, *arg1) for (arg0, arg1) in arg_combinations if arg0[0] not in arg1]
-				else:
-					arg_combinations = [(*arg0, *arg1) for (arg0, arg1) in arg_combinations]
-				#print ("ARG_COMBINATIONS: ", arg_combinations)
-				pred_value = np.average([predicate(*arg) for arg in arg_combinations])
-				if math.isnan(pred_value):
-					pred_value = 0
-				predicate_values.append(((*rel[0], *ref[0]), pred_value))
-		else:
-			arg_combinations = rel_tuples
-			pred_value = np.average([predicate(*arg) for arg in arg_combinations])
-			predicate_values.append(((*rel[0], None), pred_value))
+						arg_combinations = [(*arg0, *arg1) for (arg0, arg1) in arg_combinations]
+					#print ("ARG_COMBINATIONS: ", arg_combinations)
+					yield ((*rel[0], *ref[0]), arg_combinations)
+			else:
+				yield ((*rel[0], None), rel_tuples)
+
+	def value(arg_combinations):
+		pred_value = np.average([values[arg] if arg in values else evaluate(predicate, *arg) for arg in arg_combinations])
+		return 0 if math.isnan(pred_value) else pred_value
+
+	def bound(arg_combinations):
+		if arg_combinations == [] or any(arg not in bounds for arg in arg_combinations):
+			return math.inf
+		return np.average([bounds[arg] for arg in arg_combinations])
+
+	predicate_values = []
+	if len(bounds) > 0 and superlative:
+		#The values of the remaining entries are at most their bounds, so once the next
+		#bound is below the second best value, the two best values are known
+		entries = list(entries())
+		order = sorted(range(len(entries)), key = lambda k: bound(entries[k][1]), reverse=True)
+		computed = []
+		best = []
+		for k in order:
+			if len(best) == 2 and bound(entries[k][1]) < best[1]:
+				break
+			pred_value = value(entries[k][1])
+			computed.append((k, pred_value))
+			best = sorted(best + [pred_value], reverse=True)[:2]
+		computed.sort(key = lambda x: x[0])
+		predicate_values = [(entries[k][0], pred_value) for (k, pred_value) in computed]
+	elif threshold is not None:
+		witnessed = set()
+		for args, arg_combinations in entries():
+			if bound(arg_combinations) < threshold - 1e-9:
+				continue
+			pred_value = value(arg_combinations)
+			if pred_value >= threshold:
+				predicate_values.append((args, pred_value))
+				witnessed.add(args[0])
+				if witnesses is not None and len(witnessed) >= witnesses:
+					break
+	else:
+		predicate_values = [(args, value(arg_combinations)) for (args, arg_combinations) in entries()]
 
 	#predicate_values = [(arg, predicate(*arg)) for arg in arg_combinations]
 	predicate_values.sort(key = lambda x: x[1], reverse=True)
@@ -366,148 +629,9 @@ def filter_by_mod(entities, modifier, entity_list):
 	elif type(modifier) == TDet:
 		return filter_by_determiner(entities, modifier)
 	elif type(modifier) == TAdj or type(modifier) == NPred:
-		#print ("ADJ PROCESSING... PRED = ", modifier, " RELATA = ", entities)
-		#pred = NPred(content = modifier.content, mods = modifier.mods)
-		predicate_values = process_predicate(modifier, relata=entities, entity_list=entity_list)
-
-		#Now extract the arg0
-		answer_set = {}
-		for (item, val) in predicate_values:
-			if item[0] not in answer_set.keys():
-				answer_set[item[0]] = 0
-			answer_set[item[0]] = max(answer_set[item[0]], val)
-		
-		answer_set = [(key, answer_set[key]) for key in answer_set.keys()]
-		return answer_set				
-
-def process_predicate(predicate, relata=None, referents=None, entity_list=None):
-	"""
-	Processes the predicate by computing its values over all the combinations
-	of arguments and then appyling each modifiers to obtain more and more
-	restricted list of argument tuples that satisfy the constraints of the
-	predicate.
-
-	"""
-	#print ("ENTERING PREDICATE PROCESSING: ", predicate)
-	predicate_func = resolve_predicate(predicate)
-	pred_str = predicate.content
-	pred_arity = arity[predicate_func]
-	modifiers = predicate.mods
-	print ("\nPREDICATE COMPONENTS: ", predicate, modifiers, relata, referents)
-	unique = False
-	unary = False
-
-	#Resolve arguments
-	if relata is None:
-		relata = resolve_argument(predicate.children[0], entity_list) if len(predicate.children) > 0 else None
-		if referents is None:
-			referents = resolve_argument(predicate.children[1], entity_list) if len(predicate.children) > 1 else None
-	elif referents is None:
-		referents = resolve_argument(predicate.children[0], entity_list) if predicate.children is not None and len(predicate.children) > 0 else None
-	# print ("RESOLVED RELATA:", relata)
-	# print ("RESOLVED REFERENTS:", referents)
-	
-	#For handling "Where" and color requests
-	# if predicate_func == spatial.where:		
-	# 	predicate_values = [spatial.where(relatum[0]) for relatum in relata]
-	# 	print ("WHERE PRED VALUES: ", predicate_values)
-	# 	return predicate_values
-	# elif predicate_func == color_pred:
-	# 	predicate_values = [color_pred(relatum[0]) for relatum in relata]
-	# 	return predicate_values
-
-	if predicate_func == spatial.between and len(referents) > 0 and type(referents[0][0]) != tuple:
-		referents = form_arg_tuples(referents, 2)
-
-	if predicate_func == spatial.where or predicate_func == color_pred:
-		predicate_values = [((relatum[0], predicate_func(relatum[0])), 1.0) for relatum in relata]		
-		#print ("WHERE/COLOR PRED VALUES: ", predicate_values)
-		return predicate_values
-
-	#For superlatives	
-	if (referents is None or referents == []) and pred_arity == 2:
-		unique = True
-		unary = True
-		referents = [(tuple(world.active_context), 1.0)]
-		
-	print ("FINAL RELATA: ", relata)
-	print ("FINAL REFERENTS: ", referents)
-	predicate_values, ret_val = compute_predicate(predicate_func, relata, referents)
-
-	if unary:
-		predicate_values = [((arg[0],), val) for (arg, val) in predicate_values]
-	
-	#print ("PREDICATE VALUES: ", predicate_values)	
-	if modifiers is not None and modifiers != []:
-		for modifier in modifiers:
-			predicate_values = filter_by_predicate_modifier(predicate_values, modifier)
-	elif predicate_values is not None and predicate_values != []:
-		if unique == False:
-			predicate_values = [(arg, val) for (arg, val) in predicate_values if val >= 0.7]
-		else:
-			if len(predicate_values) > 1:
-				if predicate_values[0][1] > predicate_values[1][1] + 0.3:
-					predicate_values = [predicate_values[0]]
-				else:
-					predicate_values = []
-
-	print ("FINAL PREDICATE VALUES: ",  predicate_values)
-
-	return predicate_values
-
-def resolve_argument(arg_object, entities):
-	ret_args = entities
-
-	if type(arg_object) == NArg and (arg_object.obj_type is None or arg_object.obj_id is None or arg_object.obj_type.lower() != "table" or arg_object.obj_id.lower() != "table"):
-		entities = [item for item in entities if "table" not in item.type_structure]
-
-	#print ("RESOLVING THE ARGUMENT...", arg_object)
-
-	if type(arg_object) == NConjArg:
-		args1 = resolve_argument(arg_object.children[0], entities)
-		args2 = resolve_argument(arg_object.children[1], entities)
-		ret_args = []
-		for arg1 in args1:
-			for arg2 in args2:
-				ret_args.append(((arg1[0], arg2[0]), (arg1[1]+arg2[1]) / 2))
-		return ret_args
-
-	arg_type = arg_object.obj_type
-	arg_id = arg_object.obj_id
-	arg_det = arg_object.det
-	arg_plur = arg_object.plur
-	arg_mods = arg_object.mods
-	#arg_mods.reverse()
-
-	#print (arg_object)
-	#print ("ARG CANDIDATES: ", entities)
-	if arg_type is not None:
-		ret_args = filter_by_type(ret_args, arg_type)
-
-	#print ("AFTER TYPE RESOLUTION:", ret_args)
-
-	if arg_id is not None:
-		ret_args = filter_by_name(ret_args, arg_id)
-
-	#print ("AFTER NAME RESOLUTION:", ret_args)
-
-	if ret_args is not None and ret_args != []:
-		if type(ret_args[0]) != tuple:
-			ret_args = [(item, 1.0) for item in ret_args]
-
-	#print ("\nARGS BEFORE MODIFIERS: ", ret_args, arg_mods)
-	if arg_mods is not None and arg_mods != []:
-		for modifier in arg_mods:
-			#print ("CURRENT MOD: ", modifier)
-			ret_args = filter_by_mod(ret_args, modifier, entities)
-			#print ("CURRENT ARGS: ", ret_args)
-
-	#print ("\nAFTER MOD APPLICATION:", ret_args)
-
-	if arg_det is not None:
-		ret_args = filter_by_determiner(ret_args, arg_det)
-	#print ("\nFINAL RESOLVED ARGS: ", ret_args)	
-	return ret_args
+		#Predicate modifiers are computed by a nested predicate plan (see query_plan.py)
+		plan = query_plan.PredicateFilter(query_plan.PredicatePlan(modifier, nested=True))
+		return plan.apply(entities, entity_list, query_plan.PlanStatistics(entity_list))
 
 def resolve_predicate(predicate_object):	
 	if type(predicate_object) == str:
@@ -523,60 +647,17 @@ def resolve_predicate(predicate_object):
 	return pred
 
 def process_query(query, entities):
-	relata = []
-	referents = []
-	
-	if query.predicate is not None:
-		print ("\nENTERING PRED PROCESSING...")
-		pred = query.predicate
-
-		predicate_values = process_predicate(pred, entity_list=entities)
-		# if query.query_type == query.QueryType.DESCR or query.query_type == query.QueryType.ATTR_COLOR:
-		# 	return predicate_values		
-		if predicate_values is not None and predicate_values != []:
-			relata = [(arg[0], val) for (arg, val) in predicate_values]
-		
-			if len(predicate_values[0][0]) > 1:
-				referents = [(arg[1:], val) for (arg, val) in predicate_values]
-				if referents is not None and len(referents) > 0:
-					referents.sort(key = lambda x: x[1], reverse = True)
-					if query.arg1_singular:
-						referents = [referents[0]]
-			
-	elif query.arg is not None:#type(arg) == NArg:		
-		#print ("\nENTERING TOP LEVEL ARG PROCESSING...")
-		arg = query.arg
-		relata = resolve_argument(arg, entities)
-		#print ("RESOLVED RELATA:", relata)		
-		if relata != None and relata != []:
-			if type(relata[0]) != tuple:
-				relata = [(item, 1.0) for item in relata]
-	else:
-		return "FAIL"
-
-	relata.sort(key = lambda x: x[1], reverse = True)
-
-	#Remove duplicates
-	encountered_relata = []
-	filtered_relata = []
-	for (arg, val) in relata:
-		if arg not in encountered_relata:
-			encountered_relata.append(arg)
-			filtered_relata.append((arg, val))
-	relata = filtered_relata
-
-	#print ("IS ARG0 SINGULAR? ", query.arg0_singular)
-	if len(relata) > 0 and query.arg0_singular:		
-		relata = [relata[0]]
-
-	#print ("RETURNED RESOLVED ARG0, ARG1 ", relata, referents)
-	#print ("ACTIVE CONTEXT: ", world.active_context)
-
-	# if query.arg is not None and query.arg.obj_type is not None and query.arg.obj_type.lower() != "table" or\
-	# 	query.relatum is not None and query.relatum.obj_type is not None and query.relatum.obj_type.lower() != "table":
-	relata = [item for item in relata if "table" not in item[0].type_structure]
-	#print ("ANSWER SETS: ", relata, referents)
-	return relata, referents
+	"""
+	Compile the query into an operator plan (see query_plan.py) and execute it over the entities.
+
+	Return:
+	The lists of (relatum, certainty) and (referents, certainty) pairs of the answer
+
+	"""
+	plan = query_plan.compile_query(query)
+	if debug_plans:
+		print ("\nQUERY PLAN:\n" + plan.explain(entities))
+	return plan.execute(entities)
 
 
 class Response():
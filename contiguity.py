@@ -0,0 +1,106 @@
+import math
+
+import spatial
+from entity import geometry_stamp
+
+
+class ContiguityGraph(object):
+    """
+    Contact graph of the scene, used to split sets of entities into contiguous groups.
+
+    Two entities are in contact if either of them touches the other with a degree
+    above the threshold. The candidate pairs come from the broad-phase spatial
+    index of the world, and the groups are the connected components of the contact
+    graph, found with a union-find structure. When some entities move, only the
+    contacts of the moved entities are re-evaluated.
+    """
+
+    def __init__(self, world, threshold=0.85):
+        self.world = world
+        self.threshold = threshold
+        self.version = None
+        self.entities = []
+        self.geometry_version = {}
+        self.contacts = {}
+        self.max_perimeter = 0
+
+    def refresh(self):
+        """Bring the contacts up to date with the world."""
+        if self.version == geometry_stamp(self.world) and self.entities == self.world.entities:
+            return self
+        if self.entities != self.world.entities:
+            self.entities = list(self.world.entities)
+            self.contacts = {entity: set() for entity in self.entities}
+            moved = self.entities
+        else:
+            moved = [entity for entity in self.entities
+                     if entity.geometry_version != self.geometry_version[entity]]
+            for entity in moved:
+                for other in self.contacts[entity]:
+                    self.contacts[other].discard(entity)
+                self.contacts[entity] = set()
+        self.geometry_version = {entity: entity.geometry_version for entity in self.entities}
+        self.max_perimeter = max([entity.face_arrays['perimeter'].max(initial=0) for entity in self.entities], default=0)
+        for entity in moved:
+            for other in self.candidates(entity):
+                if other not in self.contacts[entity] and self.in_contact(entity, other):
+                    self.contacts[entity].add(other)
+                    self.contacts[other].add(entity)
+        self.version = geometry_stamp(self.world)
+        return self
+
+    def candidates(self, entity):
+        """
+        Return the entities of the world that can be in contact with the given one.
+
+        Contact with a non-planar entity requires either the scaled mesh distance below 0.1,
+        which bounds the gap between the bounding boxes by 0.1 of the entity size, or a vertex
+        lying on a face, which bounds the gap by the face perimeter over 2 * pi (see
+        geometry_utils.max_face_contact). Planar entities are matched against all the others.
+        """
+        others = [other for other in self.entities if other is not entity]
+        if entity.get('planar') is not None:
+            return others
+        index = self.world.spatial_index
+        index.refresh()
+        reach = max(0.1 * (entity.size + 0.01), self.max_perimeter / (2 * math.pi + math.log(0.95)))
+        near = set(index.candidates(entity, reach))
+        return [other for other in others if other in near or other.get('planar') is not None]
+
+    def in_contact(self, a, b):
+        relations = self.world.relations
+        return relations.value(spatial.touching, a, b) > self.threshold or \
+            relations.value(spatial.touching, b, a) > self.threshold
+
+    def groups(self, entities):
+        """
+        Return the contiguous groups of the given entities, as lists of entities.
+        The groups and the entities within them follow the order of the input.
+        """
+        self.refresh()
+        parent = {entity: entity for entity in entities}
+
+        def find(entity):
+            while parent[entity] is not entity:
+                parent[entity] = parent[parent[entity]]
+                entity = parent[entity]
+            return entity
+
+        def union(a, b):
+            root_a, root_b = find(a), find(b)
+            if root_a is not root_b:
+                parent[root_b] = root_a
+
+        for entity in entities:
+            if entity in self.contacts:
+                neighbours = [other for other in self.contacts[entity] if other in parent]
+            else:
+                #Entities outside of the world (e.g., sub-entities) are matched directly
+                neighbours = [other for other in entities if other is not entity and self.in_contact(entity, other)]
+            for other in neighbours:
+                union(entity, other)
+
+        groups = {}
+        for entity in entities:
+            groups.setdefault(find(entity), []).append(entity)
+        return list(groups.values())
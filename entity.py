@@ -1,5 +1,3 @@
-import bpy
-import bpy_types
 import numpy as np
 import math
 from math import e, pi
@@ -8,11 +6,71 @@ import os
 import sys
 import random
 import enum
-from mathutils import Vector
+try:
+	import bpy
+	import bpy_types
+	from mathutils import Vector
+except ImportError:
+	#Running without Blender, on a scene loaded from a snapshot (see headless.py)
+	bpy = bpy_types = Vector = None
 
 from geometry_utils import *
+from mesh_cache import mesh_cache, canopy_cache, mesh_hash, is_rigid
+from snapshot import SnapshotObject
 import utils
 
+#Types of the scene objects an entity can be made of
+object_types = (bpy_types.Object, SnapshotObject) if bpy_types is not None else (SnapshotObject,)
+
+
+def lazy_geometry(compute):
+	"""
+	Turn the method computing a derived attribute of the entity into a property.
+	The value is computed on first access and cached until the geometry of the
+	entity is recomputed. Assigning to the property overrides the cached value.
+	"""
+	name = compute.__name__
+
+	def get(self):
+		if name not in self.geometry_cache:
+			self.geometry_cache[name] = compute(self)
+		return self.geometry_cache[name]
+
+	def set(self, value):
+		self.geometry_cache[name] = value
+
+	return property(get, set, doc=compute.__doc__)
+
+
+class SceneHierarchy(object):
+	"""
+	Index of the mesh children of the objects in the Blender scene, built with
+	a single pass over the scene objects. The index is rebuilt on the next lookup
+	after update is called, or if the number of objects in the scene has changed.
+	"""
+
+	def __init__(self, scene):
+		self.scene = scene
+		self.children = None
+		self.size = None
+
+	def update(self):
+		"""Mark the index as outdated, e.g., after objects have been added or re-parented."""
+		self.children = None
+
+	def build(self):
+		self.children = {}
+		self.size = len(self.scene.objects)
+		for ob in self.scene.objects:
+			if ob.parent is not None and ob.type == "MESH":
+				self.children.setdefault(ob.parent, []).append(ob)
+
+	def get_children(self, parent):
+		"""Return the list of mesh children of the object, in the order of the scene objects."""
+		if self.children is None or self.size != len(self.scene.objects):
+			self.build()
+		return self.children.get(parent, [])
+
 
 class Entity(object):
 	"""
@@ -20,7 +78,14 @@ class Entity(object):
 	objects in the scene, such as primitives, composite structures, regions.
 	"""
 
-	scene = bpy.context.scene
+	scene = bpy.context.scene if bpy is not None else None
+
+	#Parent -> mesh children index of the scene objects
+	hierarchy = SceneHierarchy(scene)
+
+	#Incremented every time an entity recomputes or shifts its geometry after it has been
+	#built, e.g., in move_to, which does not advance the version of the world
+	geometry_epoch = 0
 
 	#Enumerates possible categories the entity object can belong to
 	class Category(enum.Enum):
@@ -30,7 +95,7 @@ class Entity(object):
 
 	def __init__(self, components, name=None, explore_children=True):
 
-		if type(components) == bpy_types.Object:
+		if isinstance(components, object_types):
 			components = [components]
 
 		self.components = components
@@ -42,15 +107,14 @@ class Entity(object):
 			while len(queue) != 0:
 				parent = queue[0]
 				queue.pop(0)
-				for ob in Entity.scene.objects:                
-					if ob.parent == parent and ob.type == "MESH":
-						self.components.append(ob)
-						queue.append(ob)
+				for ob in Entity.hierarchy.get_children(parent):
+					self.components.append(ob)
+					queue.append(ob)
 
-		if len(self.components) == 1 and type(self.components[0]) == bpy_types.Object:
+		if len(self.components) == 1 and isinstance(self.components[0], object_types):
 			self.category = self.Category.PRIMITIVE		
 
-		elif len(self.components) > 1 and type(self.components[0]) == Entity or type(self.components[0]) == bpy_types.Object: 
+		elif len(self.components) > 1 and type(self.components[0]) == Entity or isinstance(self.components[0], object_types): 
 			self.category = self.Category.STRUCTURE
 		
 			ent_components = []
@@ -76,29 +140,36 @@ class Entity(object):
 		#This structure will be stored as a list
 		#['Props', 'Furniture', 'Chair']
 		self.type_structure = self.compute_type_structure()
+
+		#The entity table of the world and the row of the entity in it,
+		#set when the entity is added to the table
+		self.table = None
+		self.row = None
+
 		self.compute_geometry()
 		
 		#Color of the entity
 		self.color_mod = self.get_color_mod()
 
-	def compute_geometry(self):
-		#Compute mesh-related data
-		self.vertex_set = self.compute_vertex_set()
-		self.faces = self.compute_faces()
+	def compute_geometry(self, vertex_set=None):
+		#Incremented every time the geometry is recomputed,
+		#so that cached relation values can be refreshed
+		self.geometry_version = getattr(self, 'geometry_version', -1) + 1
+		if self.geometry_version > 0:
+			Entity.geometry_epoch += 1
+
+		#Cache of the derived properties, which are computed on first access
+		#(see lazy_geometry at the end of the class)
+		self.geometry_cache = {}
+
+		#Compute mesh-related data: the (V, 3) array of vertex coordinates
+		self.vertex_set = self.compute_vertex_set() if vertex_set is None else vertex_set
 
 		#The coordiante span of the entity. In other words,
 		#the minimum and maximum coordinates of entity's points
-		self.span = self.compute_span()
+		self.set_span(self.compute_span())
 
-		#Separate values for the span of the entity, for easier access
-		self.x_max = self.span[1]
-		self.x_min = self.span[0]
-		self.y_max = self.span[3]
-		self.y_min = self.span[2]
-		self.z_max = self.span[5]
-		self.z_min = self.span[4]
-
-		#The bounding box, stored as a list of triples of vertex coordinates
+		#The bounding box, stored as an (8, 3) array of vertex coordinates
 		self.bbox = self.compute_bbox()
 
 		#Bounding box's centroid
@@ -116,26 +187,41 @@ class Entity(object):
 	  
 		#The fundamental intrinsic vectors
 		self.up = np.array([0, 0, 1])
-		self.front = np.array(self.components[0].get('frontal')) \
-			if self.components[0].get('frontal') is not None else self.generate_frontal()
-		#print ("FRONT: ", self.components[0].get('frontal'), self.generate_frontal(), self.front)
-		if self.front is not None and len(self.front) == len(self.up):
-			self.right = np.cross(self.front, self.up)
-		else:
-			self.right = None #np.array([0, -1, 0])
 
-		# if self.category == self.Category.STRUCTURE:
-		#  	print (self.name, self.type_structure, self.up, self.front, self.right)
+		#Write the new values into the row of the entity in the world's table
+		if self.table is not None:
+			self.table.write(self)
+	   
+	def set_span(self, span):
+		self.span = span
 
-		#self.canopy = self.get_canopy()
+		#Separate values for the span of the entity, for easier access
+		self.x_max = self.span[1]
+		self.x_min = self.span[0]
+		self.y_max = self.span[3]
+		self.y_min = self.span[2]
+		self.z_max = self.span[5]
+		self.z_min = self.span[4]
+
+	def translate(self, offset):
+		"""
+		Shift the geometry of the entity by the offset. The bounds and the centroids
+		are shifted directly, and the cached properties that do not depend on the
+		position of the entity are kept.
+		"""
+		self.geometry_version += 1
+		Entity.geometry_epoch += 1
+		self.geometry_cache = {name: value for name, value in self.geometry_cache.items()
+							   if name in self.translation_invariant}
+		self.vertex_set = self.vertex_set + offset
+		self.set_span([value + offset[axis // 2] for axis, value in enumerate(self.span)])
+		self.bbox = self.bbox + offset
+		self.bbox_centroid = self.bbox_centroid + offset
+		self.centroid = self.centroid + offset
+		self.location = self.centroid
+		if self.table is not None:
+			self.table.write(self)
 
-		self.radius = self.compute_radius()
-		self.volume = self.compute_volume()
-		self.size = self.compute_size()
-	   
-		self.parent_offset = self.compute_parent_offset()
-		self.ordering = self.induce_linear_order()
-	   
 	def set_type_structure(self, type_structure):        
 		self.type_structure = type_structure
 
@@ -156,78 +242,83 @@ class Entity(object):
 
 	def compute_vertex_set(self):
 		"""
-		Compute and return the total vertex set of the entity.
+		Compute and return the total vertex set of the entity as a (V, 3) array.
 		In case of a primitive or a structure it is the union 
 		of the meshes of constituent objects.
 		"""
-		vertices = []
 		if self.category == self.Category.PRIMITIVE:
-			# 	vertices += [self.components[0].matrix_world @ v.co for v in self.components[0].data.vertices]
-			# for ent in self.components:
-			vertices = [self.components[0].matrix_world @ v.co for v in self.components[0].data.vertices]
-			# for obj in self.components:
-			# 	vertices += [obj.matrix_world @ v.co for v in obj.data.vertices]
-			vertices = [np.array([v[0],v[1],v[2]]) for v in vertices]
-		elif self.category == self.Category.STRUCTURE:
-			vertices = [v for e in self.components for v in e.vertex_set]
+			#The local-space geometry is shared by the primitives using the same mesh,
+			#and is kept together with the transform for the rigid updates
+			self.mesh = mesh_cache.get(self.components[0].data)
+			self.local_vertices = self.mesh.vertices
+			self.matrix_world = np.array(self.components[0].matrix_world)
+			return self.transform(self.matrix_world)
+		elif self.category == self.Category.STRUCTURE and len(self.components) > 0:
+			return np.concatenate([e.vertex_set for e in self.components])
 		elif self.category == self.Category.REGION:
-			vertices = self.components
-		return vertices
+			return np.array(self.components, dtype=float).reshape(-1, 3)
+		return np.zeros((0, 3))
 
-	def compute_faces(self):
-		"""Compute and return the list of faces of the entity."""
-		faces = []
-		#print ("CAT: ", self.category)
+	def transform(self, matrix):
+		"""Return the local-space vertices of the primitive transformed by the matrix."""
+		return self.local_vertices @ matrix[:3, :3].T + matrix[:3, 3]
+
+	def compute_face_indices(self):
+		"""Compute and return the list of arrays of vertex indices of the faces of the entity."""
+		indices = []
 		if self.category == self.Category.PRIMITIVE:
-			for face in self.components[0].data.polygons:
-			 	faces.append([self.components[0].matrix_world @ self.components[0].data.vertices[i].co for i in face.vertices])
-			# for ob in self.components:
-			# for face in self.components[0].data.polygons:
-			# 	faces.append([self.components[0].matrix_world @ self.components[0].data.vertices[i].co for i in face.vertices])
+			indices = self.mesh.face_indices
 		elif self.category == self.Category.STRUCTURE:
-			faces = [f for entity in self.components for f in entity.faces]        
-		return faces
+			offset = 0
+			for entity in self.components:
+				indices += [idx + offset for idx in entity.face_indices]
+				offset += len(entity.vertex_set)
+		return indices
+
+	def compute_faces(self):
+		"""Compute and return the list of faces of the entity, each one as an array of vertex coordinates."""
+		return [self.vertex_set[idx] for idx in self.face_indices]
+
+	def compute_face_arrays(self):
+		"""Compute and return the faces packed into arrays for the batched point-in-face test."""
+		if self.category == self.Category.PRIMITIVE:
+			return self.mesh.world_face_arrays(self.matrix_world)
+		return get_face_arrays(self.vertex_set, self.face_indices)
+
+	def compute_kdtree(self):
+		"""Compute and return the KD-tree over the vertex set."""
+		if self.category == self.Category.PRIMITIVE:
+			return self.mesh.world_kdtree(self.matrix_world)
+		return build_kdtree(self.vertex_set)
 
 	def compute_span(self):
 		"""Calculate the coordinate span of the entity."""
-		return [min([v[0] for v in self.vertex_set]),
-				max([v[0] for v in self.vertex_set]),
-				min([v[1] for v in self.vertex_set]),
-				max([v[1] for v in self.vertex_set]),
-				min([v[2] for v in self.vertex_set]),
-				max([v[2] for v in self.vertex_set])]
+		mins = self.vertex_set.min(axis=0)
+		maxs = self.vertex_set.max(axis=0)
+		return [mins[0], maxs[0], mins[1], maxs[1], mins[2], maxs[2]]
 
 	def compute_bbox(self):
 		"""
 		Calculate the bounding box of the entity
-		and return it as an array of points.
+		and return it as an (8, 3) array of points.
 		"""
-		return [(self.span[0], self.span[2], self.span[4]),
-			(self.span[0], self.span[2], self.span[5]),
-		(self.span[0], self.span[3], self.span[4]),
-		(self.span[0], self.span[3], self.span[5]),
-		(self.span[1], self.span[2], self.span[4]),
-		(self.span[1], self.span[2], self.span[5]),
-		(self.span[1], self.span[3], self.span[4]),
-		(self.span[1], self.span[3], self.span[5])]
+		return np.array(list(itertools.product(self.span[0:2], self.span[2:4], self.span[4:6])))
 
 	def compute_bbox_centroid(self):
 		"""Compute and return the bounding box centroid."""
-		return np.array([self.bbox[0][0] + (self.bbox[7][0] - self.bbox[0][0]) / 2,
-						 self.bbox[0][1] + (self.bbox[7][1] - self.bbox[0][1]) / 2,
-						 self.bbox[0][2] + (self.bbox[7][2] - self.bbox[0][2]) / 2])
+		return self.bbox[0] + (self.bbox[7] - self.bbox[0]) / 2
    
 	def compute_centroid(self):
 		"""Compute and return the centroid the vertex set."""
-		return np.average(self.vertex_set, axis=0)
+		return self.vertex_set.mean(axis=0)
 
 	def compute_dimensions(self):
-		"""Gets the dimensions of the entity as a list of number."""
-		return [self.bbox[7][0] - self.bbox[0][0], self.bbox[7][1] - self.bbox[0][1], self.bbox[7][2] - self.bbox[0][2]]
+		"""Gets the dimensions of the entity as an array of numbers."""
+		return self.bbox[7] - self.bbox[0]
 
 	def compute_radius(self):
 		"""Compute and return the radius of the circumscribed sphere of the entity."""
-		return max([np.linalg.norm(v - self.centroid) for v in self.vertex_set])
+		return np.linalg.norm(self.vertex_set - self.centroid, axis=1).max()
 		"""if not hasattr(self, 'radius'):
 			total_mesh = self.get_total_mesh()
 			centroid = self.get_centroid()
@@ -259,6 +350,18 @@ class Entity(object):
 	def set_frontal(self, frontal):
 		self.frontal = frontal
 
+	def compute_front(self):
+		"""Compute and return the frontal direction of the entity."""
+		if self.components[0].get('frontal') is not None:
+			return np.array(self.components[0].get('frontal'))
+		return self.generate_frontal()
+
+	def compute_right(self):
+		"""Compute and return the direction to the right of the entity."""
+		if self.front is not None and len(self.front) == len(self.up):
+			return np.cross(self.front, self.up)
+		return None #np.array([0, -1, 0])
+
 	def generate_frontal(self):	
 		#print (self.name, self.type_structure)	
 		types_fr = ['sofa', 'bookshelf', 'desk', 'tv', 'poster', 'picture',	'fridge', 'wall']
@@ -294,6 +397,10 @@ class Entity(object):
 	def get_closest_face_distance(self, point):
 		return min([get_distance_from_plane(point, face[0], face[1], face[2]) for face in self.faces])
 
+	def get_kdtree(self):
+		"""Return the KD-tree over the vertex set, built lazily and kept until the geometry changes."""
+		return self.kdtree
+
 	#STUB
 	def get_closest_distance(self, other_entity):
 		this_faces = self.get_faces()
@@ -354,65 +461,136 @@ class Entity(object):
 		self.update()        
 
 	def update(self):
-		self.compute_geometry()
+		"""
+		Recompute the geometry of the entity after it has moved.
+
+		Primitives are rigid, so instead of re-reading their meshes only the new
+		transform is applied to the kept local-space vertices, and a pure translation
+		shifts the cached geometry directly.
+		"""
+		if self.category != self.Category.PRIMITIVE:
+			self.compute_geometry()
+			return
+		matrix = np.array(self.components[0].matrix_world)
+		if np.array_equal(matrix, self.matrix_world):
+			return
+		if np.array_equal(matrix[:3, :3], self.matrix_world[:3, :3]):
+			offset = matrix[:3, 3] - self.matrix_world[:3, 3]
+			self.matrix_world = matrix
+			self.translate(offset)
+		else:
+			self.matrix_world = matrix
+			self.compute_geometry(self.transform(matrix))
 
 	def get_component_vectors(self):
 		centroid = np.average([item.location for item in self.components])
 		vectors = [item.location - centroid for item in self.components]
 		return vectors
 
-	def is_in_canopy(self, point):
-		num_samples = 80
+	def is_in_canopy(self, point, directions=None, threshold=None, tree=None):
+		"""
+		Return the fraction of the rays cast from the point in random directions that hit the entity
+		(or the given BVH tree of the entity, e.g., in its local space).
+
+		If the threshold is given, the casting stops as soon as it is decided whether the
+		fraction exceeds the threshold, and the fraction computed so far is returned,
+		which lies on the same side of the threshold as the full one.
+		"""
+		if directions is None:
+			directions = np.random.normal(0, 1, (80, 3))
+			directions = directions / np.linalg.norm(directions, axis=1)[:, None]
+		tree = tree if tree is not None else self.bvhtree
+		num_samples = len(directions)
+		needed = int(math.floor(threshold * num_samples)) + 1 if threshold is not None else num_samples + 1
 		total_hits = 0
-		for i in range(num_samples):
-			u = np.random.normal(0,1)
-			v = np.random.normal(0,1)
-			w = np.random.normal(0,1)
-			vec = np.array([u, v, w])
-			vec = vec / np.linalg.norm(vec)
-			is_hit = False
-			for comp in self.components:
-				hit, loc, norm, face = comp.ray_cast(point, vec)
-				is_hit = hit or is_hit
-			if is_hit:
+		for idx, vec in enumerate(directions):
+			location, normal, index, dist = tree.ray_cast(point, vec)
+			if location is not None:
 				total_hits += 1
+			if total_hits >= needed or total_hits + num_samples - idx - 1 < needed:
+				break
 		return float(total_hits) / num_samples
 
-	def compute_canopy(self):
-		x_min = 1e10
-		x_max = -1e10
-		y_min = 1e10
-		y_max = -1e10
-		z_min = 1e10
-		z_max = -1e10
-		for i in range(500):
-			x = np.random.uniform(self.span[0], self.span[1])
-			y = np.random.uniform(self.span[2], self.span[3])
-			z = np.random.uniform(self.span[4], self.span[5])
-			point = np.array([x, y, z])
-			if self.is_in_canopy(point) > 0.8:
-				print ("in canopy: ", point)
-				x_min = min(x_min, point[0])
-				y_min = min(y_min, point[1])
-				z_min = min(z_min, point[2])
-				x_max = max(x_max, point[0])
-				y_max = max(y_max, point[1])
-				z_max = max(z_max, point[2])
-		print (x_min, x_max, y_min, y_max, z_min, z_max)
-		if x_min < x_max and y_min < y_max and z_min < z_max:
-			return np.array([x_min, x_max, y_min, y_max, z_min, z_max])
+	def compute_canopy(self, num_points=500, num_samples=80, threshold=0.8, vertices=None):
+		"""
+		Estimate the canopy of the entity, i.e., the bounding box of the points around which
+		more than the threshold fraction of the rays cast in random directions hit the entity.
+		If the vertices of the entity in another frame (e.g., its local space) are given,
+		the canopy is estimated in that frame.
+		"""
+		tree = None
+		span = self.span
+		if vertices is not None:
+			tree = BVHTree.FromPolygons(vertices.tolist(), [idx.tolist() for idx in self.face_indices])
+			span = np.stack([vertices.min(axis=0), vertices.max(axis=0)], axis=1).ravel()
+		points = np.random.uniform(span[0::2], span[1::2], (num_points, 3))
+		directions = np.random.normal(0, 1, (num_points, num_samples, 3))
+		directions = directions / np.linalg.norm(directions, axis=2)[:, :, None]
+		inside = np.array([self.is_in_canopy(point, dirs, threshold, tree) > threshold
+						   for point, dirs in zip(points, directions)], dtype=bool)
+		if inside.sum() < 2:
+			return None
+		lows = points[inside].min(axis=0)
+		highs = points[inside].max(axis=0)
+		if np.all(lows < highs):
+			return np.array([lows[0], highs[0], lows[1], highs[1], lows[2], highs[2]])
+		else:
+			return None
+
+	def compute_bvhtree(self):
+		"""Compute and return the BVH tree over the faces of the entity."""
+		return BVHTree.FromPolygons(self.vertex_set.tolist(), [idx.tolist() for idx in self.face_indices])
+
+	def compute_shape(self):
+		"""Compute and return the shape class and the reference planes and axes of the entity."""
+		return Shape(self)
+
+	def local_frame(self):
+		"""
+		Return the rigid transform of the local space of the entity (the space of the mesh of a
+		primitive, or of the first component of a structure), the vertices of the entity in that
+		space and the key of its local-space mesh, or None if the entity has no such space.
+		"""
+		if self.category == self.Category.PRIMITIVE:
+			if not is_rigid(self.matrix_world):
+				return None
+			return self.matrix_world, self.mesh.vertices, self.mesh.get_hash()
+		elif self.category == self.Category.STRUCTURE and len(self.components) > 0 and \
+				getattr(self.components[0], 'matrix_world', None) is not None:
+			matrix = np.array(self.components[0].matrix_world)
 		else:
 			return None
+		if not is_rigid(matrix):
+			return None
+		vertices = (self.vertex_set - matrix[:3, 3]) @ matrix[:3, :3]
+		return matrix, vertices, mesh_hash(vertices, self.face_indices)
 
 	def get_canopy(self):
+		"""
+		Return the canopy of the entity. The canopies are persisted in a sidecar file next
+		to the .blend file, in the local space of the entities and keyed by their local-space
+		meshes, so that an entry stays valid when the entity moves and is shared by the
+		entities with the same mesh.
+		"""
 		if self.components[0].get('canopy') is not None:
 			return self.components[0]['canopy']
-		else:
-			canopy = self.compute_canopy()
-			if canopy is not None:
-				self.components[0]['canopy'] = canopy
-				bpy.ops.wm.save_mainfile(filepath=bpy.data.filepath)
-			return canopy
+		frame = self.local_frame()
+		if frame is None:
+			return self.compute_canopy()
+		matrix, vertices, key = frame
+		filepath = bpy.data.filepath if bpy is not None else None
+		cache = canopy_cache.load(os.path.splitext(filepath)[0] + '.canopy.json' if filepath else 'canopy.json')
+		if not cache.contains(key):
+			cache.put(key, self.compute_canopy(vertices=vertices))
+		canopy = cache.get(key)
+		if canopy is None:
+			return None
+		#Bounding box of the corners of the local canopy in world space
+		corners = np.array(list(itertools.product(canopy[0:2], canopy[2:4], canopy[4:6])))
+		corners = corners @ matrix[:3, :3].T + matrix[:3, 3]
+		lows = corners.min(axis=0)
+		highs = corners.max(axis=0)
+		return np.array([lows[0], highs[0], lows[1], highs[1], lows[2], highs[2]])
 
 	def get_ulf(self):
 		name = '|' + self.name + '|'
@@ -441,3 +619,40 @@ class Entity(object):
 			features.append(item)
 		#features.append(self.span)
 		return features
+
+	def compute_surface_entities(self):
+		"""
+		Compute and return the entities made of the single components of the
+		entity that are working surfaces or planar.
+		"""
+		return [Entity(ob) for ob in self.components
+				if ob.get('working_surface') is not None or ob.get('planar') is not None]
+
+	#Derived properties, computed on first access and cached until the geometry changes
+	#(translation_invariant lists the ones that are kept when the entity is only translated)
+	face_indices = lazy_geometry(compute_face_indices)
+	faces = lazy_geometry(compute_faces)
+	face_arrays = lazy_geometry(compute_face_arrays)
+	kdtree = lazy_geometry(compute_kdtree)
+	front = lazy_geometry(compute_front)
+	right = lazy_geometry(compute_right)
+	radius = lazy_geometry(compute_radius)
+	volume = lazy_geometry(compute_volume)
+	size = lazy_geometry(compute_size)
+	parent_offset = lazy_geometry(compute_parent_offset)
+	ordering = lazy_geometry(induce_linear_order)
+	surface_entities = lazy_geometry(compute_surface_entities)
+	bvhtree = lazy_geometry(compute_bvhtree)
+	shape = lazy_geometry(compute_shape)
+	canopy = lazy_geometry(get_canopy)
+	translation_invariant = {'compute_face_indices', 'compute_front', 'compute_right',
+							 'compute_radius', 'compute_volume', 'compute_size'}
+
+
+def geometry_stamp(world):
+	"""
+	Return the stamp of the geometry of the world, which changes when the world records
+	moved blocks and whenever an entity recomputes its geometry (see Entity.geometry_epoch).
+	The caches of values derived from the geometry are valid as long as the stamp is unchanged.
+	"""
+	return (getattr(world, 'version', None), Entity.geometry_epoch)
@@ -0,0 +1,155 @@
+import numpy as np
+
+
+def lazy_column(attr):
+    """
+    Turn the per-entity attribute into a column of the table that is filled on
+    first access, since reading the attribute computes it (see entity.lazy_geometry).
+    Once filled, the rows written since are refreshed on the next access or update.
+    """
+
+    def get(self):
+        if attr not in self.lazy:
+            self.lazy[attr] = self.stack(attr)
+        elif len(self.stale) > 0:
+            self.fill()
+        return self.lazy[attr]
+
+    return property(get)
+
+
+class EntityTable(object):
+    """
+    Struct-of-arrays table of the geometric attributes of the entities of the world.
+
+    Every field is stored as one contiguous NumPy array with one row per entity,
+    so that the spatial relations can be evaluated over all pairs of entities in
+    a single batched pass, and the table can be handed to code that does not walk
+    the Entity objects. Each entity refers to the table by its row index and
+    writes its new values into its row in place whenever its geometry is recomputed.
+    The columns of the attributes that the entity computes lazily are filled
+    only once they are read (see lazy_column).
+    """
+
+    #Per-entity attributes packed into the arrays, with the width of their rows
+    fields = [('span', 6), ('centroid', 3), ('bbox_centroid', 3), ('location', 3),
+              ('dimensions', 3)]
+
+    #Per-entity attributes computed on first access, one value per row
+    radius = lazy_column('radius')
+    size = lazy_column('size')
+    volume = lazy_column('volume')
+
+    def __init__(self, entities):
+        self.entities = []
+        self.reset(entities)
+
+    def reset(self, entities):
+        """Rebuild the table over the given list of entities."""
+        for entity in self.entities:
+            if getattr(entity, 'table', None) is self:
+                entity.table = None
+                entity.row = None
+
+        self.entities = list(entities)
+        self.N = len(self.entities)
+        self.all = np.arange(self.N)
+
+        #Maps every entity to its row in the arrays
+        self.index = {entity: idx for idx, entity in enumerate(self.entities)}
+
+        for attr, width in self.fields:
+            setattr(self, attr, self.stack(attr, width))
+
+        #Lazy columns filled so far, and the rows written since they were last filled
+        self.lazy = {}
+        self.stale = set()
+
+        #Geometry versions of the entities at the time their rows were written
+        self.geometry_version = [entity.geometry_version for entity in self.entities]
+
+        #Rows written since the last call to update
+        self.written = set()
+
+        #Color and type codes, as indices into the vocabularies below, -1 if unknown
+        self.colors = sorted({entity.color_mod for entity in self.entities if entity.color_mod is not None})
+        self.types = sorted({entity.type_structure[-1] for entity in self.entities if entity.type_structure})
+        self.color = np.array([self.code(self.colors, entity.color_mod) for entity in self.entities], dtype=int)
+        self.type = np.array([self.code(self.types, entity.type_structure[-1] if entity.type_structure else None)
+                              for entity in self.entities], dtype=int)
+
+        #Shape classes (see geometry_utils.Shape), for which near_raw and touching use
+        #the distances to the reference planes and axes, and the closest mesh distance
+        self.planar = self.flag('planar')
+        self.rod = self.flag('vertical_rod') | self.flag('horizontal_rod') | self.flag('rod')
+        self.concave = self.flag('concave')
+        self.extended = self.flag('extended')
+
+        for idx, entity in enumerate(self.entities):
+            entity.table = self
+            entity.row = idx
+
+    def write(self, entity):
+        """Write the current values of the entity into its row."""
+        idx = entity.row
+        self.geometry_version[idx] = entity.geometry_version
+        for attr, width in self.fields:
+            values = getattr(self, attr)
+            row = np.array(getattr(entity, attr), dtype=float).reshape(values[idx].shape)
+            if not np.array_equal(row, values[idx]):
+                values[idx] = row
+                self.written.add(idx)
+        if len(self.lazy) > 0:
+            self.stale.add(idx)
+
+    def fill(self):
+        """Refresh the stale rows of the lazy columns filled so far."""
+        for idx in self.stale:
+            for attr, values in self.lazy.items():
+                value = float(getattr(self.entities[idx], attr))
+                if value != values[idx]:
+                    values[idx] = value
+                    self.written.add(idx)
+        self.stale = set()
+
+    def update(self):
+        """
+        Write the rows of the entities whose geometry has been recomputed
+        without writing them, e.g., after being detached from the table.
+
+        Returns the array of indices of the rows whose values have changed
+        since the last call, in ascending order.
+        """
+        for idx, entity in enumerate(self.entities):
+            if entity.geometry_version != self.geometry_version[idx]:
+                self.write(entity)
+        self.fill()
+        moved = np.array(sorted(self.written), dtype=int)
+        self.written = set()
+        return moved
+
+    def stack(self, attr, width=None):
+        """Return the values of the given attribute of all entities as an array."""
+        values = np.array([getattr(entity, attr) for entity in self.entities], dtype=float)
+        return values.reshape(self.N, width) if width is not None else values.reshape(self.N)
+
+    def flag(self, property):
+        """Return the boolean mask of entities having the given custom property."""
+        return np.array([entity.get(property) is not None for entity in self.entities], dtype=bool)
+
+    def code(self, vocabulary, value):
+        """Return the index of the value in the vocabulary, or -1 if it is not there."""
+        return vocabulary.index(value) if value in vocabulary else -1
+
+    def pairs(self, values, I, J):
+        """
+        Broadcast the per-entity values over the block of pairs I x J.
+
+        Returns the values for the first and for the second argument, shaped
+        so that any elementwise operation on them yields a len(I) x len(J) array.
+        """
+        return values[I][:, None], values[J][None, :]
+
+    def disp(self, values, I, J):
+        """Return the pairwise difference vectors values[i] - values[j] for the block I x J."""
+        return values[I][:, None, :] - values[J][None, :, :]
@@ -1,7 +1,13 @@
 import math
 import numpy as np
-import bpy, bmesh
-from mathutils.bvhtree import BVHTree
+try:
+    import bpy, bmesh
+    from mathutils.bvhtree import BVHTree
+    from mathutils.kdtree import KDTree
+except ImportError:
+    #Running without Blender (see headless.py): the bmesh helpers are unavailable
+    #and build_kdtree falls back to ArrayKDTree
+    bpy = bmesh = BVHTree = KDTree = None
 
 
 #Computes the value of the univariate Gaussian
@@ -16,6 +22,12 @@ def gaussian(x, mu, sigma):
 def sigmoid(x, a, b):
     return a / (1 + math.e ** (- b * x)) if b * x > -100 else 0
 
+#Elementwise version of the sigmoid for NumPy arrays
+#Inputs: x - array of random variable values; a, b - coefficients
+#Return value: array of real numbers of the same shape as x
+def batch_sigmoid(x, a, b):
+    bx = b * np.asarray(x, dtype=float)
+    return np.where(bx > -100, a / (1 + np.exp(- np.maximum(bx, -100))), 0.0)
 
 #Computes the cross-product of vectors a and b
 #Inputs: a,b - vector coordinates as tuples or lists
@@ -115,123 +127,147 @@ def get_centroid_distance_scaled(ent_a, ent_b):
     return get_centroid_distance(ent_a, ent_b) / (ent_a.radius + ent_b.radius + 0.0001)
 
 
+class Shape(object):
+    """
+    Shape class of an entity and the reference planes and axes used by the
+    special-case distances of near and touching. It is computed once per
+    geometry version of the entity (see Entity.shape).
+
+    The class comes from the custom properties of the entity, in the order in
+    which near_raw_distance checks them. The planes and axes are derived from
+    the dimensions alone, as get_planar_distance_scaled and get_line_distance_scaled
+    do not require the entity to have the corresponding class.
+    """
+
+    PLANAR = 'planar'
+    ROD = 'rod'
+    CONCAVE = 'concave'
+
+    #Vertex indices into the bounding box of the pairs of planes, for each thin axis
+    plane_points = (((0, 1, 2), (4, 5, 6)), ((0, 1, 4), (2, 3, 5)), ((0, 2, 4), (1, 3, 5)))
+
+    #Vertex indices into the bounding box of the four lines, for each long axis
+    line_points = (((0, 4), (1, 5), (2, 6), (3, 7)), ((0, 2), (1, 3), (4, 6), (5, 7)), ((0, 1), (2, 3), (4, 5), (6, 7)))
+
+    def __init__(self, entity):
+        if entity.get('planar') is not None:
+            self.kind = Shape.PLANAR
+        elif entity.get('vertical_rod') is not None or entity.get('horizontal_rod') is not None or \
+            entity.get('rod') is not None:
+            self.kind = Shape.ROD
+        elif entity.get('concave') is not None:
+            self.kind = Shape.CONCAVE
+        else:
+            self.kind = None
+
+        self.dimensions = np.array(entity.dimensions, dtype=float)
+        self.centroid = np.array(entity.centroid, dtype=float)
+        bbox = np.array(entity.bbox, dtype=float)
+        dims = self.dimensions
+
+        #The axis along which the entity is much thinner than along the other two, if any
+        self.thin_axis = None
+        for axis in range(3):
+            others = [idx for idx in range(3) if idx != axis]
+            if dims[axis] <= 0.5 * dims[others[0]] and dims[axis] <= 0.5 * dims[others[1]]:
+                self.thin_axis = axis
+                break
+        if self.thin_axis is not None:
+            planes = [[bbox[idx] for idx in points] for points in Shape.plane_points[self.thin_axis]]
+            self.normals = np.array([get_normal(*points) for points in planes])
+            self.offsets = np.array([points[0].dot(normal) for points, normal in zip(planes, self.normals)])
+            self.normal_lengths = np.linalg.norm(self.normals, axis=1)
+
+        #The axis along which the entity is much longer than along the other two, if any
+        self.long_axis = None
+        for axis in range(3):
+            others = [idx for idx in range(3) if idx != axis]
+            if dims[axis] >= 1.4 * (dims[others[0]] + dims[others[1]]):
+                self.long_axis = axis
+                break
+        if self.long_axis is not None:
+            self.lines = np.array([[bbox[idx] for idx in points] for points in Shape.line_points[self.long_axis]])
+
+    def other_axes(self, axis):
+        return [idx for idx in range(3) if idx != axis]
+
+#Batched version of get_distance_from_line for many points against one line
+#Inputs: x1, x2 - points defining the line; points - M x 3 array of point coordinates
+#Return value: array of M real numbers
+def batch_distance_from_line(x1, x2, points):
+    if np.linalg.norm(x1 - x2) <= 0.001:
+        return np.linalg.norm(points - x1, axis=1)
+    v1 = points - x1
+    v2 = x2 - x1
+    l1 = np.linalg.norm(v1, axis=1)
+    l2 = v1 @ v2 / np.linalg.norm(v2)
+    return np.sqrt(np.abs(l1 * l1 - l2 * l2))
+
+#Batched version of get_line_distance_scaled: computes the distances from the
+#entity with the given shape to many entities at once
+#Inputs: shape - Shape of the first entity; centroids - M x 3 array of the centroids
+#of the other entities; max_dims - array of their M maximum dimensions
+#Return value: array of M real numbers
+def batch_line_distance_scaled(shape, centroids, max_dims):
+    centroids = np.asarray(centroids, dtype=float).reshape(-1, 3)
+    max_dims = np.asarray(max_dims, dtype=float)
+    axis = shape.long_axis
+    if axis is None:
+        return np.zeros(len(centroids))
+    dist = np.min([batch_distance_from_line(x1, x2, centroids) for x1, x2 in shape.lines], axis=0)
+    others = shape.other_axes(axis)
+    offset = shape.centroid[axis] - centroids[:, axis]
+    within = np.abs(offset) <= shape.dimensions[axis] / 2
+    scale = (shape.dimensions[others[0]] + shape.dimensions[others[1]]) / 2 + max_dims
+    return np.where(within, dist / scale, np.sqrt(0.5 * offset ** 2 + 0.5 * dist ** 2))
+
+#Batched version of get_planar_distance_scaled: computes the distances from the
+#entity with the given shape to many entities at once
+#Inputs: shape - Shape of the first entity; centroids - M x 3 array of the centroids
+#of the other entities; max_dims - array of their M maximum dimensions
+#Return value: array of M real numbers
+def batch_planar_distance_scaled(shape, centroids, max_dims):
+    centroids = np.asarray(centroids, dtype=float).reshape(-1, 3)
+    max_dims = np.asarray(max_dims, dtype=float)
+    axis = shape.thin_axis
+    if axis is None:
+        return np.zeros(len(centroids))
+    dist = np.min(np.abs((centroids @ shape.normals.T - shape.offsets) / shape.normal_lengths), axis=1)
+    others = shape.other_axes(axis)
+    offsets = shape.centroid[others] - centroids[:, others]
+    within = np.all(np.abs(offsets) <= shape.dimensions[others] / 2, axis=1)
+    scale = shape.dimensions[axis] + max_dims
+    return np.where(within, dist / scale, np.sqrt(0.6 * (offsets ** 2).sum(axis=1) + 0.4 * dist ** 2))
+
 #Computes the distance between two entities in the special
 #case if the first entity is elongated, i.e., can be approximated by a line or a rod
 #Inputs: ent_a, ent_b - entities
 #Return value: real number
 def get_line_distance_scaled(ent_a, ent_b):
-    a_dims = ent_a.dimensions
-    b_dims = ent_b.dimensions
-    a_bbox = ent_a.bbox
-    dist = 0
-
-    #If ent_a is elongated, one dimension should be much bigger than the sum of the other two
-    #Here we check which dimension is that
-    if a_dims[0] >= 1.4 * (a_dims[1] + a_dims[2]):
-        dist = min(get_distance_from_line(a_bbox[0], a_bbox[4], ent_b.centroid),
-                   get_distance_from_line(a_bbox[1], a_bbox[5], ent_b.centroid),
-                   get_distance_from_line(a_bbox[2], a_bbox[6], ent_b.centroid),
-                   get_distance_from_line(a_bbox[3], a_bbox[7], ent_b.centroid))
-        if math.fabs(ent_a.centroid[0] - ent_b.centroid[0]) <= a_dims[0] / 2:
-            dist /= ((a_dims[1] + a_dims[2]) / 2 + max(b_dims))
-        else:
-            dist = math.sqrt(0.5 * (ent_a.centroid[0] - ent_b.centroid[0]) ** 2 + 0.5 * dist ** 2)
-    elif a_dims[1] >= 1.4 * (a_dims[0] + a_dims[2]):
-        dist = min(get_distance_from_line(a_bbox[0], a_bbox[2], ent_b.centroid),
-                   get_distance_from_line(a_bbox[1], a_bbox[3], ent_b.centroid),
-                   get_distance_from_line(a_bbox[4], a_bbox[6], ent_b.centroid),
-                   get_distance_from_line(a_bbox[5], a_bbox[7], ent_b.centroid))
-        if math.fabs(ent_a.centroid[1] - ent_b.centroid[1]) <= a_dims[1] / 2:
-            dist /= ((a_dims[0] + a_dims[2]) / 2 + max(b_dims))
-        else:
-            dist = math.sqrt(0.5 * (ent_a.centroid[1] - ent_b.centroid[1]) ** 2 + 0.5 * dist ** 2)
-    elif a_dims[2] >= 1.4 * (a_dims[1] + a_dims[0]):
-        dist = min(get_distance_from_line(a_bbox[0], a_bbox[1], ent_b.centroid),
-                   get_distance_from_line(a_bbox[2], a_bbox[3], ent_b.centroid),
-                   get_distance_from_line(a_bbox[4], a_bbox[5], ent_b.centroid),
-                   get_distance_from_line(a_bbox[6], a_bbox[7], ent_b.centroid))
-        if math.fabs(ent_a.centroid[2] - ent_b.centroid[2]) <= a_dims[2] / 2:
-            dist /= ((a_dims[0] + a_dims[1]) / 2 + max(b_dims))
-        else:
-            dist = math.sqrt(0.5 * (ent_a.centroid[2] - ent_b.centroid[2]) ** 2 + 0.5 * dist ** 2)
-    return dist
+    return float(batch_line_distance_scaled(ent_a.shape, ent_b.centroid, [max(ent_b.dimensions)])[0])
 
 #Computes the distance between two entities in the special
 #case if the first entity is planar, i.e., can be approximated by a plane or a thin box
 #Inputs: ent_a, ent_b - entities
 #Return value: real number
 def get_planar_distance_scaled(ent_a, ent_b):
-    a_dims = ent_a.dimensions
-    b_dims = ent_b.dimensions
-    a_bbox = ent_a.bbox
-    dist = 0
-
-    #If ent_a is planar, one dimension should be much smaller than the other two
-    #Here we check which dimension is that
-    if a_dims[0] <= 0.5 * a_dims[1] and a_dims[0] <= 0.5 * a_dims[2]:
-        dist = min(get_distance_from_plane(ent_b.centroid, a_bbox[0], a_bbox[1], a_bbox[2]),
-                   get_distance_from_plane(ent_b.centroid, a_bbox[4], a_bbox[5], a_bbox[6]))
-        if math.fabs(ent_a.centroid[1] - ent_b.centroid[1]) <= a_dims[1] / 2 and \
-            math.fabs(ent_a.centroid[2] - ent_b.centroid[2]) <= a_dims[2] / 2:
-            dist /= (a_dims[0] + max(b_dims))
-        else:
-            #dist = closest_mesh_distance(ent_a, ent_b)
-            dist = math.sqrt(0.6 * ((ent_a.centroid[1] - ent_b.centroid[1]) ** 2 + (ent_a.centroid[2] - ent_b.centroid[2]) ** 2) \
-                             + 0.4 * dist ** 2)
-    elif a_dims[1] <= 0.5 * a_dims[0] and a_dims[1] <= 0.5 * a_dims[2]:
-        dist = min(get_distance_from_plane(ent_b.centroid, a_bbox[0], a_bbox[1], a_bbox[4]),
-                   get_distance_from_plane(ent_b.centroid, a_bbox[2], a_bbox[3], a_bbox[5]))
-        if math.fabs(ent_a.centroid[0] - ent_b.centroid[0]) <= a_dims[0] / 2 and \
-            math.fabs(ent_a.centroid[2] - ent_b.centroid[2]) <= a_dims[2] / 2:
-            dist /= (a_dims[1] + max(b_dims))
-        else:
-            #dist = closest_mesh_distance(ent_a, ent_b)
-            dist = math.sqrt(0.6 * ((ent_a.centroid[0] - ent_b.centroid[0]) ** 2 + (ent_a.centroid[2] - ent_b.centroid[2]) ** 2) \
-                             + 0.4 * dist ** 2)
-    elif a_dims[2] <= 0.5 * a_dims[0] and a_dims[2] <= 0.5 * a_dims[1]:
-        dist = min(get_distance_from_plane(ent_b.centroid, a_bbox[0], a_bbox[2], a_bbox[4]),
-                   get_distance_from_plane(ent_b.centroid, a_bbox[1], a_bbox[3], a_bbox[5]))
-        if math.fabs(ent_a.centroid[1] - ent_b.centroid[1]) <= a_dims[1] / 2 and \
-            math.fabs(ent_a.centroid[0] - ent_b.centroid[0]) <= a_dims[0] / 2:
-            dist /= (a_dims[2] + max(b_dims))
-        else:
-            #dist = closest_mesh_distance(ent_a, ent_b)
-            dist = math.sqrt(0.6 * ((ent_a.centroid[1] - ent_b.centroid[1]) ** 2 + (ent_a.centroid[0] - ent_b.centroid[0]) ** 2) \
-                             + 0.4 * dist ** 2)
-    return dist
+    return float(batch_planar_distance_scaled(ent_a.shape, ent_b.centroid, [max(ent_b.dimensions)])[0])
 
 
 #Computes the closest distance between the points of two meshes
 #Input: ent_a, ent_b - entities
 #Return value: real number
 def closest_mesh_distance(ent_a, ent_b):
-    min_dist = 1e9
-
-    #print (ent_a.vertex_set, ent_b.vertex_set)
     if len(ent_a.vertex_set) * len(ent_b.vertex_set) <= 1000:
-        min_dist = min([point_distance(u,v) for u in ent_a.vertex_set for v in ent_b.vertex_set])
-        return min_dist
-    
-    count = 0    
-    u0 = ent_a.vertex_set[0]
-    v0 = ent_b.vertex_set[0]
-    min_dist = point_distance(u0, v0)       
-    for v in ent_b.vertex_set:
-        if point_distance(u0, v) <= min_dist:
-            min_dist = point_distance(u0, v)
-            v0 = v
-    for u in ent_a.vertex_set:
-        if point_distance(u, v0) <= min_dist:
-            min_dist = point_distance(u, v0)
-            u0 = u
-    #lin_dist = min_dist
-    #min_dist = 1e9
-    #for v in ent_a.total_mesh:
-    #    for u in ent_b.total_mesh:
-    #        min_dist = min(min_dist, point_distance(u, v))
-    #        count += 1
-    #print ("COUNT:", count, min_dist, lin_dist)
-    return min_dist
+        points_a = np.array(ent_a.vertex_set, dtype=float).reshape(-1, 3)
+        points_b = np.array(ent_b.vertex_set, dtype=float).reshape(-1, 3)
+        return np.linalg.norm(points_a[:, None] - points_b[None], axis=2).min()
+
+    #Query the vertices of the smaller mesh against the KD-tree of the larger one
+    if len(ent_a.vertex_set) > len(ent_b.vertex_set):
+        ent_a, ent_b = ent_b, ent_a
+    tree = ent_b.get_kdtree()
+    return min([tree.find(v)[2] for v in ent_a.vertex_set])
 
 #Normalized version of closest_mesh_distance where the distance is scaled
 #by the maximum dimensions of two entities
@@ -281,6 +317,36 @@ def get_bbox_intersection(ent_a, ent_b):
     vol = int_x * int_y * int_z    
     return vol
 
+#Stand-in for mathutils.kdtree.KDTree when running without Blender,
+#answering the nearest neighbour queries by a vectorized brute-force search
+class ArrayKDTree(object):
+    def __init__(self, points):
+        self.points = np.asarray(points, dtype=float).reshape(-1, 3)
+
+    def find(self, co):
+        dists = np.linalg.norm(self.points - np.asarray(co, dtype=float), axis=1)
+        index = int(np.argmin(dists))
+        return self.points[index], index, float(dists[index])
+
+#Builds a KD-tree over a set of points for the nearest neighbour queries
+#Input: points - list of point coordinates
+#Return value: balanced mathutils.kdtree.KDTree, or ArrayKDTree without Blender
+def build_kdtree(points):
+    if KDTree is None:
+        return ArrayKDTree(points)
+    tree = KDTree(len(points))
+    for idx, point in enumerate(points):
+        tree.insert(point, idx)
+    tree.balance()
+    return tree
+
+#Computes the distance between two axis-aligned bounding boxes given by their spans
+#Input: span_a, span_b - spans of the form [x_min, x_max, y_min, y_max, z_min, z_max]
+#Return value: real number, zero if the boxes overlap
+def span_distance(span_a, span_b):
+    gaps = [max(0, span_b[2 * i] - span_a[2 * i + 1], span_a[2 * i] - span_b[2 * i + 1]) for i in range(3)]
+    return math.sqrt(gaps[0] ** 2 + gaps[1] ** 2 + gaps[2] ** 2)
+
 #Checks whether the entity is vertically oriented
 #Input: ent_a - entity
 #Return value: boolean value
@@ -317,6 +383,29 @@ def within_cone(v1, v2, threshold):
     else:
         return 1
 
+def batch_within_cone(v1, v2, threshold):
+    """
+    Elementwise version of within_cone for a stack of vectors v1
+    (an array of shape (..., 3)) against a single direction v2.
+
+    """
+    v1 = np.asarray(v1, dtype=float)
+    v2 = np.asarray(v2, dtype=float)
+    l1 = np.linalg.norm(v1, axis=-1)
+    l2 = np.linalg.norm(v2)
+    if l2 == 0:
+        cos = np.where(l1 == 0, 1.0, 0.0)
+    else:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cos = np.clip(v1.dot(v2) / (l1 * l2), -1, 1)
+        cos = np.where(l1 == 0, 0.0, cos)
+    tangent = np.tan(0.5 * math.pi * (cos - threshold) / (1 + np.sign(threshold - cos) * threshold))
+    ret_val = np.ones(tangent.shape)
+    mid = (tangent >= -20) & (tangent <= 20)
+    ret_val[mid] = 1 / (1 + np.exp(-tangent[mid]))
+    ret_val[tangent < -40] = 0
+    return ret_val
+
 def distance(a, b):
     """
     Compute distance between a and b.
@@ -466,6 +555,15 @@ def eye_projection(point, up, right, focus_dist, eye_dist):
     right0 = scaling_factor * point.dot(right) / np.linalg.norm(right)
     return right0, up0
 
+#Batched version of eye_projection for an array of points
+#Inputs: points - N x 3 array of point coordinates; up, right - observer's axes;
+#focus_dist, eye_dist - distances from the observer to the focus and to the visual plane
+#Return value: N x 2 array of the projected (right, up) coordinates
+def batch_eye_projection(points, up, right, focus_dist, eye_dist):
+    scaling_factor = (focus_dist - eye_dist) / focus_dist
+    axes = np.array([np.array(right) / np.linalg.norm(right), np.array(up) / np.linalg.norm(up)], dtype=float)
+    return scaling_factor * np.asarray(points, dtype=float).reshape(-1, 3) @ axes.T
+
 def signed_point_to_plane_dist(point, face):
     unit_norm = get_normal(face[0], face[1], face[2])
     dist = np.dot(unit_norm, point - face[0])
@@ -499,6 +597,79 @@ def is_in_face(point, face):
 #    print (angle)
     return math.e ** (- math.fabs(angle - 2 * math.pi))
 
+#Pads the lists of vertex indices of the faces to the same length by repeating their last index
+#Input: face_indices - list of arrays of vertex indices, or an already padded F x K array
+#Return value: F x K array of vertex indices
+def pad_face_indices(face_indices):
+    if isinstance(face_indices, np.ndarray):
+        return face_indices
+    width = max([len(idx) for idx in face_indices])
+    return np.array([np.pad(idx, (0, width - len(idx)), mode='edge') for idx in face_indices], dtype=int)
+
+#Packs the faces of a mesh into arrays for the batched point-in-face test.
+#Faces with fewer vertices are padded by repeating their last vertex, which only
+#adds zero-length edges that do not change the angle sum computed by is_in_face
+#Inputs: vertices - (V, 3) array of vertex coordinates; face_indices - list of
+#arrays of indices of the vertices of each face, or their padded array
+#Return value: dictionary with the padded face vertices (F x K x 3), the unit normals and
+#offsets of the face planes, the bounding boxes of the faces and their perimeters
+def get_face_arrays(vertices, face_indices):
+    if len(face_indices) == 0:
+        return {'vertices': np.zeros((0, 1, 3)), 'normals': np.zeros((0, 3)), 'offsets': np.zeros(0),
+                'min': np.zeros((0, 3)), 'max': np.zeros((0, 3)), 'perimeter': np.zeros(0)}
+    padded = pad_face_indices(face_indices)
+    width = padded.shape[1]
+    vertices = np.asarray(vertices, dtype=float)[padded]
+    normals = np.cross(vertices[:, 1 % width] - vertices[:, 0], vertices[:, 2 % width] - vertices[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)
+    normals = np.where(lengths[:, None] > 0, normals / np.maximum(lengths, 1e-300)[:, None], 0.0)
+    edges = np.roll(vertices, -1, axis=1) - vertices
+    return {'vertices': vertices,
+            'normals': normals,
+            'offsets': np.einsum('ij,ij->i', normals, vertices[:, 0]),
+            'min': vertices.min(axis=1),
+            'max': vertices.max(axis=1),
+            'perimeter': np.linalg.norm(edges, axis=2).sum(axis=1)}
+
+#Batched version of the maximum of is_in_face(v, face) over the given vertices and faces
+#Only the degrees above the threshold are of interest, so the pairs of a vertex and a face
+#that provably cannot exceed it are skipped, and 0 is returned if no pair exceeds it
+#Inputs: vertices - point coordinates; face_arrays - faces packed by get_face_arrays;
+#threshold - the degree to exceed
+#Return value: real number
+def max_face_contact(vertices, face_arrays, threshold=0.95, chunk=20000):
+    points = np.asarray(vertices, dtype=float).reshape(-1, 3)
+    if len(points) == 0 or len(face_arrays['perimeter']) == 0:
+        return 0
+
+    #A segment of length L subtends an angle of at most L / d from a point at the distance d,
+    #so the angle sum at a point farther from a face than its perimeter / (2 * pi - tolerance)
+    #is too small for the degree exp(-|angle - 2 * pi|) to exceed the threshold
+    reach = face_arrays['perimeter'] / (2 * math.pi + math.log(threshold))
+
+    #Early out if the bounding box of the points is too far from all the faces
+    gap = np.maximum(face_arrays['min'].min(axis=0) - points.max(axis=0), 0) + \
+          np.maximum(points.min(axis=0) - face_arrays['max'].max(axis=0), 0)
+    if np.linalg.norm(gap) > reach.max():
+        return 0
+
+    box_dist = np.linalg.norm(np.maximum(face_arrays['min'][None] - points[:, None], 0) +
+                              np.maximum(points[:, None] - face_arrays['max'][None], 0), axis=2)
+    plane_dist = np.abs(points @ face_arrays['normals'].T - face_arrays['offsets'])
+    point_idx, face_idx = np.nonzero((box_dist <= reach) & (plane_dist <= reach))
+
+    best = 0
+    for start in range(0, len(point_idx), chunk):
+        vecs = face_arrays['vertices'][face_idx[start:start + chunk]] - \
+               points[point_idx[start:start + chunk]][:, None]
+        norms = np.linalg.norm(vecs, axis=2)
+        units = vecs / np.maximum(norms, 1e-300)[:, :, None]
+        cosa = np.clip(np.sum(units * np.roll(units, -1, axis=1), axis=2), -1, 1)
+        angle = np.arccos(cosa).sum(axis=1)
+        degree = np.where((norms < 0.00001).any(axis=1), 1, np.exp(- np.abs(angle - 2 * math.pi)))
+        best = max(best, float(degree.max()))
+    return best if best > threshold else 0
+
 def camera_matrix(location, direction):
     pass
 
@@ -519,9 +690,6 @@ def get_2d_size(bbox):
     return radius
 
 
-import bpy
-import bmesh
-
 def bmesh_copy_from_object(obj, transform=True, triangulate=True, apply_modifiers=False):
     """
     Returns a transformed, triangulated copy of the mesh
@@ -622,6 +790,38 @@ def bmesh_check_intersect_objects(obj, obj2):
 
 #print("There are%s intersections." % ("" if intersect else " NO"))
 
+#BVH trees of the Blender objects tested by intersection_check, keyed by the mesh and the world transform
+bvhtree_cache = {}
+
+#Maximum number of trees kept in bvhtree_cache, which is cleared when it fills up
+BVHTREE_CACHE_SIZE = 256
+
+def object_bvhtree(obj):
+    """
+    Return the BVH tree of the mesh of a Blender object in world space, reusing
+    the cached tree if the object has not moved since it was built.
+    """
+    matrix = np.array(obj.matrix_world, dtype=float)
+    key = (obj.data, len(obj.data.vertices), matrix.tobytes())
+    tree = bvhtree_cache.get(key)
+    if tree is None:
+        if len(bvhtree_cache) >= BVHTREE_CACHE_SIZE:
+            bvhtree_cache.clear()
+        coords = np.empty(3 * len(obj.data.vertices))
+        obj.data.vertices.foreach_get('co', coords)
+        vertices = coords.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3]
+        tree = BVHTree.FromPolygons(vertices.tolist(), [list(face.vertices) for face in obj.data.polygons])
+        bvhtree_cache[key] = tree
+    return tree
+
+#Checks whether two coordinate spans overlap (touching spans count as overlapping)
+#Inputs: span_a, span_b - spans [x_min, x_max, y_min, y_max, z_min, z_max]
+#Return value: boolean value
+def spans_overlap(span_a, span_b):
+    return span_a[0] <= span_b[1] and span_b[0] <= span_a[1] and \
+        span_a[2] <= span_b[3] and span_b[2] <= span_a[3] and \
+        span_a[4] <= span_b[5] and span_b[4] <= span_a[5]
+
 def intersection_check(a, b):
     """
     Check if two Blender objects are intersecting.
@@ -634,27 +834,32 @@ def intersection_check(a, b):
 
     """
 
-    #Create and fill bmesh data
-    
-    bm1 = bmesh.new()
-    bm1.from_mesh(a.data)
-    bm2 = bmesh.new()
-    bm2.from_mesh(b.data)            
-
-    bm1.transform(a.matrix_world)
-    bm2.transform(b.matrix_world) 
-
-    #Create BVH trees based on bmeshes
-    a_BVHtree = BVHTree.FromBMesh(bm1)
-    b_BVHtree = BVHTree.FromBMesh(bm2)           
-
     #Check if the overlap set is empty and return the result
-    return a_BVHtree.overlap(b_BVHtree) != []
+    return object_bvhtree(a).overlap(object_bvhtree(b)) != []
+
+def get_primitives(entity):
+    """Return the list of primitive entities making up the entity."""
+    if entity.category != entity.Category.STRUCTURE:
+        return [entity]
+    return [item for comp in entity.components for item in get_primitives(comp)]
 
 def intersection_entities(a, b):
-    for acomp in a.components:
-        for bcomp in b.components:
-            if intersection_check(acomp, bcomp):
+    """
+    Check if the meshes of two entities intersect each other.
+
+    The bounding boxes of the entities, then of their primitive components, are
+    compared first, so the BVH trees are only tested for the pairs of components
+    whose boxes overlap. The trees are kept by the components (Entity.bvhtree)
+    until they move.
+    """
+    if not spans_overlap(a.span, b.span):
+        return False
+    b_primitives = get_primitives(b)
+    for acomp in get_primitives(a):
+        if not spans_overlap(acomp.span, b.span):
+            continue
+        for bcomp in b_primitives:
+            if spans_overlap(acomp.span, bcomp.span) and acomp.bvhtree.overlap(bcomp.bvhtree) != []:
                 return True
             
     return False
@@ -0,0 +1,94 @@
+import numpy as np
+
+import spatial
+import constraint_solver
+from entity import Entity, SceneHierarchy
+from snapshot import SnapshotMesh, SnapshotObject, load_snapshot
+from relation_engine import RelationEngine
+from support_graph import SupportGraph
+from spatial_index import SpatialIndex
+from contiguity import ContiguityGraph
+from entity_table import EntityTable
+from relation_memo import RelationMemo
+
+
+class HeadlessWorld(object):
+    """
+    World built from a scene snapshot (see snapshot.py) without Blender.
+
+    It provides the entities, the observer and the derived structures used by
+    spatial and constraint_solver, set up as in World, but none of the
+    Blender-side input processing, so the reasoning stack can run in plain
+    CPython processes, e.g., workers and test harnesses.
+    """
+
+    def __init__(self, scene):
+        self.scene = scene
+        self.entities = []
+        self.active_context = []
+
+        #Set the fundamental extrinsic axes
+        self.right_axis = np.array([1, 0, 0])
+        self.front_axis = np.array([0, -1.0, 0])
+        self.up_axis = np.array([0, 0, 1.0])
+
+        self.version = 0
+
+        #Entity construction looks the children of the objects up in the scene
+        Entity.scene = scene
+        Entity.hierarchy = SceneHierarchy(scene)
+
+        for obj in self.scene.objects:
+            if obj.get('main') is not None and obj.get('enabled') is None:
+                self.entities.append(Entity(obj))
+                if self.entities[-1].name.lower() != "table":
+                    self.active_context.append(self.entities[-1])
+
+        self.N = len(self.entities)
+        self.observer = self.create_observer()
+
+        self.table = EntityTable(self.entities)
+        self.spatial_index = SpatialIndex(self.entities)
+        self.relations = RelationEngine(self)
+        self.support_graph = SupportGraph(self)
+        self.contiguity = ContiguityGraph(self)
+        self.memo = RelationMemo(self)
+
+    def get_observer(self):
+        return self.observer
+
+    def create_observer(self):
+        """Create the observer entity at the location of the camera, as World.create_observer does."""
+        location = self.scene.camera_location if self.scene.camera_location is not None \
+            else np.array([0, -9.0, 3.0])
+        observer = self.scene.get_object("Observer")
+        if observer is None:
+            observer = SnapshotObject("Observer", SnapshotMesh("Observer", [location], []), np.eye(4))
+        observer_entity = Entity(observer, explore_children=False)
+        observer_entity.location = np.array(location)
+        observer_entity.up = np.array([0, 1, 3])
+        observer_entity.right = np.array([1, 0, 0])
+        observer_entity.set_frontal(observer_entity.location)
+        return observer_entity
+
+    def update(self, moved):
+        """Recompute the geometry of the moved entities after their transforms have been changed."""
+        for entity in moved:
+            entity.update()
+        if len(moved) > 0:
+            self.version += 1
+            self.spatial_index.refresh()
+            self.relations.refresh()
+            self.memo.clear()
+
+
+def load_world(path):
+    """
+    Load a snapshot file into a HeadlessWorld and bind it to the reasoning
+    modules, as main.py does for the Blender world.
+    """
+    world = HeadlessWorld(load_snapshot(path))
+    spatial.entities = world.entities
+    spatial.world = world
+    constraint_solver.world = world
+    return world
@@ -0,0 +1,153 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+from geometry_utils import build_kdtree, get_face_arrays, pad_face_indices
+
+
+def is_rigid(matrix):
+    """Check whether the transform is a rotation followed by a translation, without scaling."""
+    rotation = np.asarray(matrix, dtype=float)[:3, :3]
+    return np.allclose(rotation @ rotation.T, np.eye(3))
+
+
+class TransformedKDTree(object):
+    """
+    KD-tree over the local-space vertices of a mesh, queried in world space.
+    Only valid for rigid transforms, which preserve the distances.
+    """
+
+    def __init__(self, tree, matrix):
+        self.tree = tree
+        self.matrix = np.asarray(matrix, dtype=float)
+        self.inverse = np.linalg.inv(self.matrix)
+
+    def find(self, co):
+        """Return the closest vertex to the point as (coordinates, index, distance), like KDTree.find."""
+        local = self.inverse[:3, :3] @ np.asarray(co, dtype=float) + self.inverse[:3, 3]
+        local_co, index, dist = self.tree.find(local)
+        return self.matrix[:3, :3] @ np.asarray(local_co, dtype=float) + self.matrix[:3, 3], index, dist
+
+
+class LocalMesh(object):
+    """
+    Local-space geometry of a mesh datablock, shared by all the entities using the mesh:
+    the vertices, the vertex indices of the faces, the face planes and the KD-tree.
+    """
+
+    def __init__(self, mesh):
+        coords = np.empty(3 * len(mesh.vertices))
+        mesh.vertices.foreach_get('co', coords)
+        self.vertices = coords.reshape(-1, 3)
+        self.vertices.flags.writeable = False
+        self.face_indices = [np.array(face.vertices, dtype=int) for face in mesh.polygons]
+        self.padded_faces = pad_face_indices(self.face_indices) if len(self.face_indices) > 0 \
+            else np.zeros((0, 1), dtype=int)
+        self.face_arrays = get_face_arrays(self.vertices, self.padded_faces)
+        self.kdtree = None
+        self.hash = None
+
+    def get_kdtree(self):
+        """Return the KD-tree over the local vertices, built on first use."""
+        if self.kdtree is None:
+            self.kdtree = build_kdtree(self.vertices)
+        return self.kdtree
+
+    def get_hash(self):
+        """Return the hash of the mesh (see mesh_hash), computed on first use."""
+        if self.hash is None:
+            self.hash = mesh_hash(self.vertices, self.face_indices)
+        return self.hash
+
+    def world_kdtree(self, matrix):
+        """Return a KD-tree over the vertices transformed by the matrix."""
+        if is_rigid(matrix):
+            return TransformedKDTree(self.get_kdtree(), matrix)
+        return build_kdtree(self.vertices @ matrix[:3, :3].T + matrix[:3, 3])
+
+    def world_face_arrays(self, matrix):
+        """Return the face arrays (see geometry_utils.get_face_arrays) of the mesh transformed by the matrix."""
+        if not is_rigid(matrix):
+            return get_face_arrays(self.vertices @ matrix[:3, :3].T + matrix[:3, 3], self.padded_faces)
+        rotation = matrix[:3, :3]
+        translation = matrix[:3, 3]
+        local = self.face_arrays
+        vertices = local['vertices'] @ rotation.T + translation
+        normals = local['normals'] @ rotation.T
+        return {'vertices': vertices,
+                'normals': normals,
+                'offsets': local['offsets'] + normals @ translation,
+                'min': vertices.min(axis=1),
+                'max': vertices.max(axis=1),
+                'perimeter': local['perimeter']}
+
+
+class MeshCache(object):
+    """
+    Cache of the local-space geometry of the meshes, keyed by the mesh datablock,
+    so that the primitives sharing a mesh (e.g., the blocks) read and keep it once.
+    """
+
+    def __init__(self):
+        self.meshes = {}
+
+    def get(self, mesh):
+        """Return the local geometry of the mesh, reading it if it is new or its vertex count has changed."""
+        local = self.meshes.get(mesh)
+        if local is None or len(local.vertices) != len(mesh.vertices):
+            local = LocalMesh(mesh)
+            self.meshes[mesh] = local
+        return local
+
+    def clear(self):
+        self.meshes = {}
+
+
+mesh_cache = MeshCache()
+
+
+def mesh_hash(vertices, face_indices):
+    """Return a hash of the mesh geometry, with the coordinates rounded so that it is stable across reloads."""
+    digest = hashlib.sha1(np.round(np.asarray(vertices, dtype=float), 6).tobytes())
+    for idx in face_indices:
+        digest.update(np.asarray(idx, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+class CanopyCache(object):
+    """
+    Sidecar JSON file with the canopies of the entities, keyed by the hash of their meshes.
+    Replaces storing the canopies in the custom properties and re-saving the .blend file.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.canopies = {}
+
+    def load(self, path):
+        """Switch to the cache file at the path, reading it if it exists."""
+        if path != self.path:
+            self.path = path
+            self.canopies = {}
+            if os.path.exists(path):
+                with open(path) as file:
+                    self.canopies = json.load(file)
+        return self
+
+    def contains(self, key):
+        return key in self.canopies
+
+    def get(self, key):
+        """Return the cached canopy as an array, or None if the entity has no canopy."""
+        canopy = self.canopies.get(key)
+        return np.array(canopy) if canopy is not None else None
+
+    def put(self, key, canopy):
+        """Store the canopy (possibly None) and write the cache file."""
+        self.canopies[key] = np.asarray(canopy).tolist() if canopy is not None else None
+        with open(self.path, 'w') as file:
+            json.dump(self.canopies, file)
+
+
+canopy_cache = CanopyCache()
@@ -0,0 +1,663 @@
+import math
+from collections import Counter
+
+import spatial
+import constraint_solver as solver
+from ulf_grammar import *
+from query_frame import QueryFrame
+
+
+#Estimated cost of evaluating a relation for one tuple of arguments, in units of
+#the cost of testing one entity against a filter: the relations batched by the
+#relation engine are read from its matrices, the others are evaluated one by one
+BATCHED_RELATION_COST = 1.0
+PAIRWISE_RELATION_COST = 50.0
+SCALAR_RELATION_COST = 20.0
+
+#Fraction of the argument tuples assumed to pass a relation threshold
+RELATION_SELECTIVITY = 0.3
+
+
+class PlanStatistics(object):
+    """Counts of the types, names and colors of the entities, used to estimate the selectivity of the filters."""
+
+    def __init__(self, entities):
+        self.N = len(entities)
+        self.types = Counter()
+        self.names = Counter()
+        self.colors = Counter()
+        for entity in entities:
+            if entity.type_structure:
+                self.types.update(set(entity.type_structure))
+                self.names[normalize_name(entity.type_structure[-1])] += 1
+            self.colors[entity.color_mod] += 1
+        self.context = len(solver.world.active_context) if solver.world is not None else self.N
+
+    def fraction(self, count):
+        return count / self.N if self.N > 0 else 0.0
+
+
+def normalize_name(name):
+    return name.lower().replace("'", "")
+
+
+def relation_cost(function):
+    """Return the estimated cost of evaluating the relation for one tuple of arguments."""
+    relations = getattr(solver.world, 'relations', None)
+    if relations is not None and relations.batched(function):
+        return BATCHED_RELATION_COST
+    if relations is not None and relations.supports(function):
+        return PAIRWISE_RELATION_COST
+    return SCALAR_RELATION_COST
+
+
+#==========================================================================================
+#Entity filters, applied to the plain list of candidate entities
+
+class EntityFilter(object):
+    """
+    Filter keeping the candidate entities with a given attribute. The entity filters
+    of an argument commute, so they are applied in the order of their rank.
+    """
+
+    #Estimated cost of testing one entity
+    cost = 1.0
+
+    def rank(self, stats):
+        """Rank of the filter in the optimal order: the cost per entity over the fraction of entities removed."""
+        return self.cost / max(1.0 - self.selectivity(stats), 1e-6)
+
+    def estimate(self, rows, stats):
+        return rows * self.selectivity(stats), rows * self.cost
+
+
+class TypeFilter(EntityFilter):
+
+    def __init__(self, type_id):
+        self.type_id = type_id
+
+    def selectivity(self, stats):
+        return 1.0 if self.type_id == 'one' else stats.fraction(stats.types[self.type_id])
+
+    def apply(self, entities):
+        return solver.filter_by_type(entities, self.type_id)
+
+    def describe(self):
+        return "Filter type=" + str(self.type_id)
+
+
+class NameFilter(EntityFilter):
+
+    cost = 1.5
+
+    def __init__(self, name):
+        self.name = name
+
+    def selectivity(self, stats):
+        return stats.fraction(stats.names[normalize_name(self.name)])
+
+    def apply(self, entities):
+        return solver.filter_by_name(entities, self.name)
+
+    def describe(self):
+        return "Filter name=" + str(self.name)
+
+
+class ColorFilter(EntityFilter):
+
+    def __init__(self, modifier):
+        self.modifier = modifier
+        self.color = modifier.content
+
+    def selectivity(self, stats):
+        return stats.fraction(stats.colors[self.color])
+
+    def apply(self, entities):
+        return solver.filter_by_color(entities, self.color)
+
+    def describe(self):
+        return "Filter color=" + str(self.color)
+
+
+#==========================================================================================
+#Steps applied to the list of (argument, certainty) pairs
+
+class PredicateFilter(object):
+    """
+    Restricts the arguments to those satisfying a predicate modifier (an adjective
+    or a relative clause, e.g., "clear" or "near the Toyota block"), whose certainty
+    becomes the best value of the predicate, as filter_by_mod does.
+    """
+
+    def __init__(self, plan):
+        self.plan = plan
+
+    def independent(self):
+        """
+        Check whether the values of the predicate for an argument do not depend on the other
+        arguments, i.e., it is unary and no superlative picks the best argument. Entity filters
+        can then be applied before it.
+        """
+        return self.plan.arity == 1 and not self.plan.superlative() and \
+            self.plan.function not in (spatial.where, solver.color_pred)
+
+    def estimate(self, rows, stats):
+        return self.plan.estimate(stats, rows)
+
+    def apply(self, args, context, stats):
+        predicate_values = self.plan.execute(context, stats, relata=args)
+        answer_set = {}
+        for (item, val) in predicate_values:
+            if item[0] not in answer_set.keys():
+                answer_set[item[0]] = 0
+            answer_set[item[0]] = max(answer_set[item[0]], val)
+        return [(key, answer_set[key]) for key in answer_set.keys()]
+
+    def describe(self):
+        return "Relation filter"
+
+
+class ResetCertainty(object):
+    """Sets the certainties of the arguments to 1, in place of a color filter moved ahead of the predicate filters."""
+
+    def estimate(self, rows, stats):
+        return rows, 0.0
+
+    def apply(self, args, context, stats):
+        return [(arg, 1.0) for (arg, val) in args]
+
+    def describe(self):
+        return "Reset certainty"
+
+
+class Count(object):
+    """
+    Forms the tuples of arguments determined by a numeral (e.g., "two blocks"),
+    as a lazy stream of at most limit tuples (all of them if the limit is None).
+    """
+
+    def __init__(self, numeral):
+        self.numeral = numeral
+        self.limit = solver.MAX_ARG_TUPLES
+
+    def estimate(self, rows, stats):
+        tuples = math.comb(int(round(rows)), solver.numeral_arity(self.numeral))
+        if self.limit is not None:
+            tuples = min(tuples, self.limit)
+        return tuples, tuples
+
+    def apply(self, args, context, stats):
+        ret_val = solver.filter_by_numeral(self.numeral, args, self.limit)
+        if solver.debug_plans and ret_val.truncated():
+            print ("TUPLES OF " + str(self.numeral.content) + " LIMITED TO " + str(self.limit))
+        return ret_val
+
+    def describe(self):
+        if self.limit is not None:
+            return "Count " + str(self.numeral.content) + " (at most " + str(self.limit) + " tuples)"
+        return "Count " + str(self.numeral.content)
+
+
+class Determiner(object):
+
+    def __init__(self, det):
+        self.det = det
+
+    def estimate(self, rows, stats):
+        return rows, 0.0
+
+    def apply(self, args, context, stats):
+        return solver.filter_by_determiner(args, self.det)
+
+    def describe(self):
+        return "Determiner " + str(self.det.content)
+
+
+class Modifier(object):
+    """Any other modifier of an argument, applied by filter_by_mod."""
+
+    def __init__(self, modifier):
+        self.modifier = modifier
+
+    def estimate(self, rows, stats):
+        return rows, rows
+
+    def apply(self, args, context, stats):
+        return solver.filter_by_mod(args, self.modifier, context)
+
+    def describe(self):
+        return "Modifier " + type(self.modifier).__name__
+
+
+#==========================================================================================
+#Steps applied to the list of predicate values
+
+class Selection(object):
+    """
+    Restricts the predicate values according to a modifier of the predicate, as
+    filter_by_predicate_modifier does: a threshold, a negation or a superlative.
+    """
+
+    def __init__(self, modifier):
+        self.modifier = modifier
+
+    def superlative(self):
+        return type(self.modifier) == TSuperMarker
+
+    def apply(self, predicate_values, unique):
+        if self.superlative() and predicate_values == []:
+            return []
+        return solver.filter_by_predicate_modifier(predicate_values, self.modifier)
+
+    def describe(self):
+        content = self.modifier.content if self.modifier.content is not None and self.modifier.content != "" \
+            else self.modifier
+        if self.superlative():
+            return "Superlative"
+        if type(content) == TNeg or content in ['not.adv-s', 'not.adv-a', 'not.mod-a']:
+            return "Negation < 0.7"
+        return "Threshold " + str(content)
+
+
+class DefaultSelection(object):
+    """
+    Restricts the predicate values when the predicate has no modifiers: the values
+    above 0.7 are kept, or only the clearly best one if the predicate is used as a
+    superlative, i.e., it is binary but its referents are empty.
+    """
+
+    def apply(self, predicate_values, unique):
+        if predicate_values is None or predicate_values == []:
+            return predicate_values
+        if unique == False:
+            return [(arg, val) for (arg, val) in predicate_values if val >= 0.7]
+        if len(predicate_values) > 1:
+            if predicate_values[0][1] > predicate_values[1][1] + 0.3:
+                return [predicate_values[0]]
+            return []
+        return predicate_values
+
+    def describe(self):
+        return "Threshold >= 0.7 (best if superlative)"
+
+
+#==========================================================================================
+#Plans
+
+class ArgumentPlan(object):
+    """
+    Plan resolving an argument of the parse tree (an NArg) into the list of
+    (entity, certainty) pairs: a scan of the entities, the entity filters in the
+    order of their rank, then the remaining modifiers and the determiner in their
+    order in the parse tree.
+    """
+
+    def __init__(self, arg_object):
+        self.arg_object = arg_object
+
+        #Arguments other than the table are resolved in a context without it
+        self.exclude_table = type(arg_object) == NArg and \
+            (arg_object.obj_type is None or arg_object.obj_id is None or
+             arg_object.obj_type.lower() != "table" or arg_object.obj_id.lower() != "table")
+
+        self.filters = []
+        if arg_object.obj_type is not None:
+            self.filters.append(TypeFilter(arg_object.obj_type))
+        if arg_object.obj_id is not None:
+            self.filters.append(NameFilter(arg_object.obj_id))
+
+        self.steps = []
+        for modifier in (arg_object.mods if arg_object.mods is not None else []):
+            if type(modifier) == NColor:
+                self.steps.append(ColorFilter(modifier))
+            elif type(modifier) == TNumber:
+                self.steps.append(Count(modifier))
+            elif type(modifier) == TDet:
+                self.steps.append(Determiner(modifier))
+            elif type(modifier) == TAdj or type(modifier) == NPred:
+                self.steps.append(PredicateFilter(PredicatePlan(modifier, nested=True)))
+            else:
+                self.steps.append(Modifier(modifier))
+        if arg_object.det is not None:
+            self.steps.append(Determiner(arg_object.det))
+
+        self.hoist_filters()
+
+    def hoist_filters(self):
+        """
+        Move the color filters ahead of the predicate filters that precede them, as long
+        as the values of those do not depend on the set of arguments. The color filter
+        sets the certainties to 1, so it is replaced by a reset of the certainties.
+        The color filters that cannot be moved are applied by filter_by_mod in place.
+        """
+        steps = []
+        movable = True
+        passed = False
+        for step in self.steps:
+            if isinstance(step, ColorFilter) and movable:
+                self.filters.append(step)
+                if passed:
+                    steps.append(ResetCertainty())
+            elif isinstance(step, ColorFilter):
+                steps.append(Modifier(step.modifier))
+            else:
+                if isinstance(step, PredicateFilter) and step.independent():
+                    passed = True
+                else:
+                    movable = False
+                steps.append(step)
+        self.steps = steps
+
+    def ordered_filters(self, stats):
+        return sorted(self.filters, key=lambda item: item.rank(stats))
+
+    def estimate(self, stats):
+        """Return the estimated number of resolved arguments and the cost of resolving them."""
+        rows, cost = stats.N, stats.N
+        for step in self.ordered_filters(stats) + self.steps:
+            rows, step_cost = step.estimate(rows, stats)
+            cost += step_cost
+        return rows, cost
+
+    def unlimit(self):
+        """Form all the tuples of the numerals of the argument (but not of its nested predicates)."""
+        for step in self.steps:
+            if isinstance(step, Count):
+                step.limit = None
+
+    def execute(self, entities, stats):
+        context = entities
+        if self.exclude_table:
+            context = [item for item in entities if "table" not in item.type_structure]
+
+        ret_args = entities
+        for entity_filter in self.ordered_filters(stats):
+            ret_args = entity_filter.apply(ret_args)
+        if ret_args is not None and ret_args != []:
+            if type(ret_args[0]) != tuple:
+                ret_args = [(item, 1.0) for item in ret_args]
+
+        for step in self.steps:
+            ret_args = step.apply(ret_args, context, stats)
+        return ret_args
+
+    def explain(self, stats, depth=0):
+        rows, cost = self.estimate(stats)
+        lines = [format_line(depth, "Argument " + describe_argument(self.arg_object), rows, cost)]
+        rows = stats.N
+        steps = [("Scan", None)] + [(item.describe(), item) for item in self.ordered_filters(stats) + self.steps]
+        for label, step in steps:
+            rows_in = rows
+            if step is not None:
+                rows, cost = step.estimate(rows, stats)
+            else:
+                cost = stats.N
+            lines.append(format_line(depth + 1, label, rows, cost))
+            if isinstance(step, PredicateFilter):
+                lines += step.plan.explain(stats, depth + 2, rows_in)
+        return lines
+
+
+class ConjunctionPlan(object):
+    """Plan resolving a conjunction of arguments (an NConjArg) into the pairs of their resolved arguments."""
+
+    def __init__(self, arg_object):
+        self.arg_object = arg_object
+        self.left = compile_argument(arg_object.children[0])
+        self.right = compile_argument(arg_object.children[1])
+
+    def estimate(self, stats):
+        left_rows, left_cost = self.left.estimate(stats)
+        right_rows, right_cost = self.right.estimate(stats)
+        return left_rows * right_rows, left_cost + right_cost + left_rows * right_rows
+
+    def unlimit(self):
+        self.left.unlimit()
+        self.right.unlimit()
+
+    def execute(self, entities, stats):
+        args1 = self.left.execute(entities, stats)
+        args2 = self.right.execute(entities, stats)
+        ret_args = []
+        for arg1 in args1:
+            for arg2 in args2:
+                ret_args.append(((arg1[0], arg2[0]), (arg1[1]+arg2[1]) / 2))
+        return ret_args
+
+    def explain(self, stats, depth=0):
+        rows, cost = self.estimate(stats)
+        return [format_line(depth, "Conjunction", rows, cost)] + \
+            self.left.explain(stats, depth + 1) + self.right.explain(stats, depth + 1)
+
+
+class PredicatePlan(object):
+    """
+    Plan computing the values of a predicate of the parse tree (an NPred or a TAdj):
+    the relata and the referents are resolved by their plans, the relation is joined
+    over their combinations, and the values are restricted by the modifiers of the
+    predicate.
+
+    The relata are resolved first, so that the referents and the relation are not
+    computed at all if there are no relata. The relation values are read in batches
+    from the relation engine where possible (see compute_predicate).
+
+    A nested plan computes a predicate modifier of an argument, whose relata are
+    the arguments being filtered, and whose only child gives the referents.
+    The numerals of its referents form at most solver.MAX_ARG_TUPLES tuples, which
+    leaves out the tuples led by the last entities; the plan at the root of a query
+    forms all the tuples of its relata and referents, which the answer lists.
+
+    The plan at the root of a counting query (see QueryPlan) stops joining a stream
+    of tuples of relata formed by a numeral as soon as every relatum that can
+    satisfy the predicate is found.
+    """
+
+    def __init__(self, predicate, nested=False):
+        self.predicate = predicate
+        self.nested = nested
+        self.query_type = None
+        self.function = solver.resolve_predicate(predicate)
+        self.arity = solver.arity[self.function]
+
+        children = predicate.children if predicate.children is not None else []
+        if nested:
+            self.relata = None
+            self.referents = compile_argument(children[0]) if len(children) > 0 else None
+        else:
+            self.relata = compile_argument(children[0]) if len(children) > 0 else None
+            self.referents = compile_argument(children[1]) if len(children) > 1 else None
+
+        modifiers = predicate.mods if predicate.mods is not None else []
+        self.selections = [Selection(modifier) for modifier in modifiers] if modifiers != [] \
+            else [DefaultSelection()]
+
+    def unlimit(self):
+        for plan in (self.relata, self.referents):
+            if plan is not None:
+                plan.unlimit()
+
+    def superlative(self):
+        return any(isinstance(step, Selection) and step.superlative() for step in self.selections)
+
+    def estimate(self, stats, relata_rows=None):
+        """Return the estimated number of predicate values kept and the cost of computing them."""
+        cost = 0.0
+        if relata_rows is None:
+            relata_rows, cost = self.relata.estimate(stats) if self.relata is not None else (0, 0.0)
+        if self.referents is not None:
+            referents_rows, referents_cost = self.referents.estimate(stats)
+            cost += referents_cost
+        else:
+            referents_rows = stats.context if self.arity == 2 else 1
+        if self.function == spatial.between:
+            referents_rows = referents_rows * (referents_rows - 1) / 2
+        tuples = relata_rows * max(referents_rows, 1)
+        cost += tuples * relation_cost(self.function)
+        return tuples * RELATION_SELECTIVITY, cost
+
+    def execute(self, entity_list, stats, relata=None):
+        if relata is None:
+            relata = self.relata.execute(entity_list, stats) if self.relata is not None else None
+        if relata is not None and len(relata) == 0:
+            return []
+        referents = self.referents.execute(entity_list, stats) if self.referents is not None else None
+
+        if self.function == spatial.between and len(referents) > 0 and type(referents[0][0]) != tuple:
+            referents = solver.ArgTuples(referents, 2, limit=None)
+
+        if self.function == spatial.where or self.function == solver.color_pred:
+            return [((relatum[0], self.function(relatum[0])), 1.0) for relatum in relata]
+
+        #For superlatives
+        unique = False
+        unary = False
+        if (referents is None or len(referents) == 0) and self.arity == 2:
+            unique = True
+            unary = True
+            referents = [(tuple(solver.world.active_context), 1.0)]
+
+        threshold, superlative = solver.selection_cutoff(self.predicate.mods, unique)
+        predicate_values, ret_val = solver.compute_predicate(self.function, relata, referents, threshold, superlative,
+                                                             self.witnesses(relata))
+
+        if unary:
+            predicate_values = [((arg[0],), val) for (arg, val) in predicate_values]
+
+        for selection in self.selections:
+            predicate_values = selection.apply(predicate_values, unique)
+        return predicate_values
+
+    def witnesses(self, relata):
+        """
+        Return the number of distinct relata satisfying the predicate that answers the query:
+        all the possible ones for a counting query, whose answer is their number.
+        None if all the tuples of relata must be joined, as for the other queries,
+        whose answers list all the relata found with their certainties.
+        """
+        if not isinstance(relata, solver.ArgTuples):
+            return None
+        if self.query_type == QueryFrame.QueryType.COUNT:
+            return relata.first_arguments()
+        return None
+
+    def explain(self, stats, depth=0, relata_rows=None):
+        rows, cost = self.estimate(stats, relata_rows)
+        name = self.predicate.content if type(self.predicate.content) == str else type(self.predicate.content).__name__
+        lines = [format_line(depth, "Predicate " + str(name), rows, cost)]
+        for selection in reversed(self.selections):
+            lines.append(format_line(depth + 1, selection.describe()))
+        lines.append(format_line(depth + 1, "Join " + solver.func_to_rel_map.get(self.function, str(self.function)) +
+                                 " (cost per tuple " + str(relation_cost(self.function)) + ")"))
+        if self.relata is not None:
+            lines += self.relata.explain(stats, depth + 2)
+        elif self.nested:
+            lines.append(format_line(depth + 2, "Arguments being filtered"))
+        if self.referents is not None:
+            lines += self.referents.explain(stats, depth + 2)
+        elif self.arity == 2:
+            lines.append(format_line(depth + 2, "Active context (superlative)", stats.context))
+        return lines
+
+
+class QueryPlan(object):
+    """
+    Operator plan of a query, compiled from its QueryFrame. Executing the plan
+    returns the answer sets of the query (see constraint_solver.process_query).
+    Use explain to get the plan with the estimated numbers of rows and costs.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        if query.predicate is not None:
+            self.root = PredicatePlan(query.predicate)
+            self.root.query_type = getattr(query, 'query_type', None)
+        elif query.arg is not None:
+            self.root = compile_argument(query.arg)
+        else:
+            self.root = None
+        #The answer lists the relata (and referents) found, so none of the tuples are left out
+        if self.root is not None:
+            self.root.unlimit()
+
+    def execute(self, entities):
+        query = self.query
+        relata = []
+        referents = []
+
+        stats = PlanStatistics(entities)
+        if query.predicate is not None:
+            predicate_values = self.root.execute(entities, stats)
+            if predicate_values is not None and predicate_values != []:
+                relata = [(arg[0], val) for (arg, val) in predicate_values]
+
+                if len(predicate_values[0][0]) > 1:
+                    referents = [(arg[1:], val) for (arg, val) in predicate_values]
+                    if referents is not None and len(referents) > 0:
+                        referents.sort(key = lambda x: x[1], reverse = True)
+                        if query.arg1_singular:
+                            referents = [referents[0]]
+        elif query.arg is not None:
+            relata = self.root.execute(entities, stats)
+            if isinstance(relata, solver.ArgTuples):
+                relata = list(relata)
+            if relata != None and relata != []:
+                if type(relata[0]) != tuple:
+                    relata = [(item, 1.0) for item in relata]
+        else:
+            return "FAIL"
+
+        relata.sort(key = lambda x: x[1], reverse = True)
+
+        #Remove duplicates
+        encountered_relata = []
+        filtered_relata = []
+        for (arg, val) in relata:
+            if arg not in encountered_relata:
+                encountered_relata.append(arg)
+                filtered_relata.append((arg, val))
+        relata = filtered_relata
+
+        if len(relata) > 0 and query.arg0_singular:
+            relata = [relata[0]]
+
+        relata = [item for item in relata if "table" not in item[0].type_structure]
+        return relata, referents
+
+    def explain(self, entities=None):
+        """Return the plan as indented text, with the estimates for the given (by default, the world's) entities."""
+        if self.root is None:
+            return "FAIL"
+        stats = PlanStatistics(entities if entities is not None else solver.world.entities)
+        return "\n".join(self.root.explain(stats))
+
+    def __str__(self):
+        return self.explain()
+
+
+def compile_argument(arg_object):
+    """Compile an argument of the parse tree into its plan."""
+    if type(arg_object) == NConjArg:
+        return ConjunctionPlan(arg_object)
+    return ArgumentPlan(arg_object)
+
+
+def compile_query(query):
+    """Compile the QueryFrame into its QueryPlan."""
+    return QueryPlan(query)
+
+
+def describe_argument(arg_object):
+    parts = [str(arg_object.obj_type)]
+    if arg_object.obj_id is not None:
+        parts.append("|" + str(arg_object.obj_id) + "|")
+    if arg_object.det is not None:
+        parts.append(str(arg_object.det.content))
+    return " ".join(parts)
+
+
+def format_line(depth, label, rows=None, cost=None):
+    line = "  " * depth + label
+    if rows is not None:
+        line += "  [rows ~{:.1f}".format(rows)
+        line += ", cost ~{:.0f}]".format(cost) if cost is not None else "]"
+    return line
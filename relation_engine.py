@@ -0,0 +1,534 @@
+import numpy as np
+
+import spatial
+from entity import geometry_stamp
+from geometry_utils import batch_sigmoid, batch_within_cone, batch_planar_distance_scaled, batch_line_distance_scaled
+
+
+class RelationEngine(object):
+    """
+    Computes and caches the N x N matrices of the binary spatial relations
+    over the entities of the world.
+
+    Relations whose definition only involves the spans, centroids, dimensions
+    and radii of the entities are computed for all pairs at once by vectorized
+    kernels that mirror the scalar functions in spatial.py. Relations that
+    require the full mesh geometry are evaluated by their scalar functions,
+    one pair at a time on first access, and memoized in the same matrices.
+
+    The matrices persist across the changes of the world: when some entities
+    move, only their rows and columns are recomputed for the relations that
+    depend on the two arguments alone, while the relations that depend on
+    scene-wide statistics are recomputed from scratch on the next access.
+    """
+
+    def __init__(self, world):
+        self.world = world
+        self.version = None
+        self.arrays = None
+        self.matrices = {}
+
+        #Bounding boxes of the projections onto the observer's visual plane,
+        #computed on demand by the deictic relations, and the observer's pose they are for
+        self.proj_bbox = None
+        self.pose = None
+
+        #Relations computed by a vectorized kernel over a block of pairs I x J
+        self.kernels = {
+            spatial.above: self.above,
+            spatial.higher_than: self.higher_than,
+            spatial.at_same_height: self.at_same_height,
+            spatial.larger_than: self.larger_than,
+            spatial.inside: self.inside,
+            spatial.get_proj_intersection: self.proj_intersection,
+            spatial.near_raw_distance: self.near_raw_distance,
+            spatial.to_the_right_of_deic: self.to_the_right_of_deic,
+            spatial.in_front_of_deic: self.in_front_of_deic,
+            spatial.in_front_of_extr: self.in_front_of_extr,
+            spatial.in_front_of: self.in_front_of,
+        }
+
+        #Relations computed from the full matrices of other relations
+        self.derived = {
+            spatial.near_raw: self.near_raw,
+            spatial.near: self.near,
+            spatial.over: self.over,
+        }
+
+        #Relations evaluated one pair at a time on first access
+        self.pairwise = {
+            spatial.touching: spatial.touching,
+            spatial.on: spatial.on,
+            spatial.facing: spatial.facing,
+            spatial.at: self.at,
+        }
+
+        #Pairwise relations whose value depends only on the geometry of the two arguments
+        self.local = {spatial.touching, spatial.facing}
+
+        #Cheap upper bounds on the values of the pairwise relations, from the gaps between
+        #the bounding boxes and the batched relations, used to skip the pairs that cannot
+        #pass a threshold or beat the best value
+        self.bounds = {
+            spatial.touching: self.touching_bound,
+            spatial.on: self.on_bound,
+            spatial.at: self.at_bound,
+        }
+
+        #Ternary relations computed by a vectorized kernel over the figures F and the pairs P
+        self.ternary = {
+            spatial.between: self.between,
+        }
+
+        #Relations whose values depend on the pose of the observer
+        self.deictic = {spatial.to_the_right_of_deic, spatial.in_front_of_deic, spatial.in_front_of}
+
+        #Relations that are the converses of other relations, i.e., r(a, b) = r'(b, a)
+        self.transposed = {
+            spatial.below: spatial.above,
+            spatial.lower_than: spatial.higher_than,
+            spatial.to_the_left_of_deic: spatial.to_the_right_of_deic,
+            spatial.behind: spatial.in_front_of,
+            spatial.under: spatial.on,
+        }
+
+    def supports(self, relation):
+        """Check whether the values of the relation can be served by the engine."""
+        return relation in self.kernels or relation in self.derived or \
+            relation in self.pairwise or relation in self.transposed
+
+    def batched(self, relation):
+        """Check whether the values of the relation are computed for whole blocks of pairs at once."""
+        if relation in self.transposed:
+            return self.batched(self.transposed[relation])
+        return relation in self.kernels or relation in self.derived
+
+    def bounded(self, relation):
+        """Check whether the engine provides an upper bound on the values of the relation."""
+        if relation in self.transposed:
+            return self.bounded(self.transposed[relation])
+        return relation in self.bounds
+
+    def upper_bound(self, relation, I, J):
+        """Return upper bounds on the values of the relation over the block of pairs I x J."""
+        self.refresh()
+        if relation in self.transposed:
+            return self.upper_bound(self.transposed[relation], J, I).T
+        return self.bounds[relation](np.asarray(I, dtype=int), np.asarray(J, dtype=int))
+
+    def triples(self, relation, F, P):
+        """
+        Return the values of the ternary relation for each figure of F and each pair of P,
+        as an array of shape len(F) x len(P), where P is an array of shape len(P) x 2
+        of the indices of the entities in the pairs.
+        """
+        self.refresh()
+        P = np.asarray(P, dtype=int).reshape(-1, 2)
+        return self.ternary[relation](np.asarray(F, dtype=int), P)
+
+    def refresh(self):
+        """
+        Bring the cached matrices up to date with the entity table of the world.
+
+        If the set of entities is unchanged, only the rows and columns of the
+        entities whose geometry has changed since the last refresh are updated.
+        If the observer has moved, the projections and the deictic relations
+        are recomputed on the next access.
+        """
+        pose = spatial.observer_pose(self.world.get_observer())
+        if self.arrays is not None and self.version == geometry_stamp(self.world) and self.pose == pose:
+            return self.arrays
+        if pose != self.pose:
+            self.proj_bbox = None
+            for relation in self.deictic:
+                self.matrices.pop(relation, None)
+            self.pose = pose
+        table = self.world.table
+        if self.arrays is not table or table.entities != self.world.entities:
+            if table.entities != self.world.entities:
+                table.reset(self.world.entities)
+            table.update()
+            self.arrays = table
+            self.matrices = {}
+            self.proj_bbox = None
+        else:
+            moved = table.update()
+            if len(moved) > 0:
+                self.update_matrices(moved)
+        self.version = geometry_stamp(self.world)
+        return self.arrays
+
+    def update_matrices(self, moved):
+        """Recompute the rows and columns of the moved entities in the cached matrices."""
+        arrays = self.arrays
+        if self.proj_bbox is not None:
+            self.proj_bbox[moved] = self.project(moved)
+        for relation in list(self.matrices.keys()):
+            mat = self.matrices[relation]
+            if relation in self.kernels:
+                mat[moved, :] = self.kernels[relation](moved, arrays.all)
+                mat[:, moved] = self.kernels[relation](arrays.all, moved)
+            elif relation in self.local:
+                mat[moved, :] = np.nan
+                mat[:, moved] = np.nan
+            else:
+                del self.matrices[relation]
+
+    def matrix(self, relation):
+        """
+        Return the N x N matrix of the values of the relation, where
+        the entry [i, j] is the value of relation(entities[i], entities[j]).
+
+        """
+        arrays = self.refresh()
+        if relation in self.transposed:
+            return self.matrix(self.transposed[relation]).T
+        if relation not in self.matrices:
+            if relation in self.kernels:
+                self.matrices[relation] = self.kernels[relation](arrays.all, arrays.all)
+            elif relation in self.derived:
+                self.matrices[relation] = self.derived[relation]()
+            else:
+                self.matrices[relation] = np.full((arrays.N, arrays.N), np.nan)
+        mat = self.matrices[relation]
+        if relation is spatial.touching:
+            self.skip_far_touching(mat)
+        if relation in self.pairwise:
+            for i, j in np.argwhere(np.isnan(mat)):
+                mat[i, j] = self.pairwise[relation](arrays.entities[i], arrays.entities[j])
+        return mat
+
+    def block(self, relation, I, J):
+        """
+        Return the values of the relation over the block of pairs I x J.
+        Unlike matrix, the pending values of the pairwise relations are
+        evaluated only within the block.
+
+        """
+        arrays = self.refresh()
+        if relation in self.transposed:
+            return self.block(self.transposed[relation], J, I).T
+        I = np.asarray(I, dtype=int)
+        J = np.asarray(J, dtype=int)
+        if relation in self.pairwise:
+            if relation not in self.matrices:
+                self.matrices[relation] = np.full((arrays.N, arrays.N), np.nan)
+            mat = self.matrices[relation]
+            for i, j in np.argwhere(np.isnan(mat[np.ix_(I, J)])):
+                mat[I[i], J[j]] = self.pairwise[relation](arrays.entities[I[i]], arrays.entities[J[j]])
+            return mat[np.ix_(I, J)]
+        if relation in self.kernels and relation not in self.matrices:
+            return self.kernels[relation](I, J)
+        return self.matrix(relation)[np.ix_(I, J)]
+
+    def skip_far_touching(self, mat):
+        """
+        Set to zero the pending values of touching for the pairs that the broad phase
+        proves to be far apart, without evaluating the scalar function.
+
+        For two non-planar entities a and b whose bounding boxes are farther apart than
+        1.5 times the sum of their radii, touching skips the mesh distance, and when the
+        gap also exceeds 0.51 of the diagonal of b, no vertex of a can be close enough
+        to a (convex) face of b to count as lying on it, so touching(a, b) is exactly 0.
+        """
+        index = getattr(self.world, 'spatial_index', None)
+        arrays = self.arrays
+        solid = ~arrays.planar
+        if index is None or not solid.any():
+            return
+        index.refresh()
+        max_radius = arrays.radius[solid].max()
+        max_diag = np.linalg.norm(arrays.dimensions[solid], axis=1).max()
+        for i, entity in enumerate(arrays.entities):
+            if not solid[i] or not np.isnan(mat[i]).any():
+                continue
+            reach = max(1.5 * (arrays.radius[i] + max_radius), 0.51 * max_diag)
+            far = solid.copy()
+            far[i] = False
+            for other in index.candidates(entity, reach):
+                if other in arrays.index:
+                    far[arrays.index[other]] = False
+            mat[i, far & np.isnan(mat[i])] = 0
+
+    def value(self, relation, a, b):
+        """
+        Return the value of relation(a, b), reading it from the relation matrix.
+        Falls back to the scalar function if either argument is not an entity of the world.
+
+        """
+        arrays = self.refresh()
+        if relation in self.transposed:
+            return self.value(self.transposed[relation], b, a)
+        i = arrays.index.get(a)
+        j = arrays.index.get(b)
+        if i is None or j is None or not self.supports(relation):
+            return relation(a, b)
+        if relation in self.pairwise:
+            if relation not in self.matrices:
+                self.matrices[relation] = np.full((arrays.N, arrays.N), np.nan)
+            mat = self.matrices[relation]
+            if np.isnan(mat[i, j]):
+                mat[i, j] = self.pairwise[relation](a, b)
+            return float(mat[i, j])
+        return float(self.matrix(relation)[i, j])
+
+    def frame_size(self):
+        """Vectorized version of spatial.get_frame_size over the world entities."""
+        span = self.arrays.span
+        return max(np.max(span[:, 1], initial=-100) - np.min(span[:, 0], initial=100),
+                   np.max(span[:, 3], initial=-100) - np.min(span[:, 2], initial=100),
+                   np.max(span[:, 5], initial=-100) - np.min(span[:, 4], initial=100))
+
+    def bbox_overlap(self, I, J, axes):
+        """Return the product of the overlaps of the spans of the entities along the given axes."""
+        span = self.arrays.span
+        overlap = 1.0
+        for axis in axes:
+            min_a, min_b = self.arrays.pairs(span[:, 2 * axis], I, J)
+            max_a, max_b = self.arrays.pairs(span[:, 2 * axis + 1], I, J)
+            overlap = overlap * np.clip(np.minimum(max_a, max_b) - np.maximum(min_a, min_b), 0, None)
+        return overlap
+
+    def project(self, I):
+        """Return the bounding boxes of the projections of the entities I onto the observer's visual plane."""
+        observer = self.world.get_observer()
+        return np.array([spatial.projection_cache.get(self.arrays.entities[idx], observer)[0]
+                         for idx in I], dtype=float).reshape(len(I), 4)
+
+    def projections(self):
+        """Return the projection bounding boxes of all the entities, computing them on first use."""
+        if self.proj_bbox is None:
+            self.proj_bbox = self.project(self.arrays.all)
+        return self.proj_bbox
+
+    #==========================================================================================
+    #Vectorized kernels. Each one mirrors the scalar function of the same name
+    #in spatial.py and returns the len(I) x len(J) block of its values.
+
+    def above(self, I, J):
+        arrays = self.arrays
+        disp = arrays.disp(arrays.centroid, I, J)
+        dim_a, dim_b = arrays.pairs(arrays.dimensions[:, 2], I, J)
+        vertical_dist_scaled = disp[..., 2] / (np.maximum(dim_a, dim_b) + 0.01)
+        return batch_within_cone(disp, np.array([0, 0, 1.0]), 0.1) * batch_sigmoid(vertical_dist_scaled, 1, 3)
+
+    def higher_than(self, I, J):
+        arrays = self.arrays
+        z_a, z_b = arrays.pairs(arrays.centroid[:, 2], I, J)
+        size_a, size_b = arrays.pairs(arrays.size, I, J)
+        #Same operator precedence as in spatial.higher_than_centroidwise
+        scaled_dist = z_a - z_b / (np.maximum(size_a, size_b) + 0.01)
+        return batch_sigmoid(scaled_dist, 1.0, 1.0)
+
+    def at_same_height(self, I, J):
+        arrays = self.arrays
+        z_a, z_b = arrays.pairs(arrays.centroid[:, 2], I, J)
+        size_a, size_b = arrays.pairs(arrays.size, I, J)
+        return np.exp(- np.abs(z_a - z_b) / (size_a + size_b + 0.01))
+
+    def larger_than(self, I, J):
+        arrays = self.arrays
+        dims_a, dims_b = arrays.pairs(arrays.dimensions.sum(axis=1), I, J)
+        with np.errstate(over='ignore'):
+            return 1 / (1 + np.exp(dims_b - dims_a))
+
+    def inside(self, I, J):
+        arrays = self.arrays
+        shared_volume = self.bbox_overlap(I, J, (0, 1, 2))
+        volume_a, volume_b = arrays.pairs(arrays.volume, I, J)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return batch_sigmoid(shared_volume / volume_b, 1.0, 1.0)
+
+    def proj_intersection(self, I, J):
+        span = self.arrays.span
+        area = self.bbox_overlap(I, J, (0, 1))
+        proj_area = (span[:, 1] - span[:, 0]) * (span[:, 3] - span[:, 2])
+        area_a, area_b = self.arrays.pairs(proj_area, I, J)
+        return np.exp(area - np.minimum(area_a, area_b))
+
+    def near_raw_distance(self, I, J):
+        """
+        Whole rows and columns of the planar entities and the rods are computed
+        at once from their shapes, following the order of the special cases in
+        spatial.near_raw_distance. The pairs with a concave or extended entity
+        are left to the scalar function.
+        """
+        arrays = self.arrays
+        entities = arrays.entities
+        dist = np.linalg.norm(arrays.disp(arrays.bbox_centroid, I, J), axis=-1)
+        centroid = arrays.centroid
+        max_dims = arrays.dimensions.max(axis=1)
+
+        #Planar first argument, then planar second argument
+        plain_a = ~arrays.planar[I]
+        plain_b = ~arrays.planar[J]
+        for p in np.flatnonzero(~plain_a):
+            row = batch_planar_distance_scaled(entities[I[p]].shape, centroid[J], max_dims[J])
+            dist[p] = np.fmin(dist[p], row)
+        for q in np.flatnonzero(~plain_b):
+            column = batch_planar_distance_scaled(entities[J[q]].shape, centroid[I[plain_a]], max_dims[I[plain_a]])
+            dist[plain_a, q] = np.fmin(dist[plain_a, q], column)
+
+        #Rods, for the pairs without a planar entity
+        for p in np.flatnonzero(plain_a & arrays.rod[I]):
+            row = batch_line_distance_scaled(entities[I[p]].shape, centroid[J[plain_b]], max_dims[J[plain_b]])
+            dist[p, plain_b] = np.fmin(dist[p, plain_b], row)
+        plain_a = plain_a & ~arrays.rod[I]
+        for q in np.flatnonzero(plain_b & arrays.rod[J]):
+            column = batch_line_distance_scaled(entities[J[q]].shape, centroid[I[plain_a]], max_dims[I[plain_a]])
+            dist[plain_a, q] = np.fmin(dist[plain_a, q], column)
+        plain_b = plain_b & ~arrays.rod[J]
+
+        concave_a, concave_b = arrays.pairs(arrays.concave, I, J)
+        extended_a, extended_b = arrays.pairs(arrays.extended, I, J)
+        scalar = ((concave_a | concave_b) & plain_a[:, None] & plain_b[None, :]) | extended_a | extended_b
+        for p, q in np.argwhere(scalar):
+            dist[p, q] = spatial.near_raw_distance(entities[I[p]], entities[J[q]])
+        return dist
+
+    def to_the_right_of_deic(self, I, J):
+        arrays = self.arrays
+        bbox = self.projections()
+        width_a, width_b = arrays.pairs(bbox[:, 1] - bbox[:, 0], I, J)
+        height_a, height_b = arrays.pairs(bbox[:, 3] - bbox[:, 2], I, J)
+        x_a, x_b = arrays.pairs((bbox[:, 0] + bbox[:, 1]) / 2, I, J)
+        y_a, y_b = arrays.pairs((bbox[:, 2] + bbox[:, 3]) / 2, I, J)
+        axial_x = (x_a - x_b) / (np.maximum(width_a, width_b) + 0.01)
+        axial_y = (y_a - y_b) / (np.maximum(height_a, height_b) + 0.01)
+
+        horizontal_component = np.where(axial_x >= 1, np.exp(- 0.05 * np.abs(axial_x - 1)), np.maximum(0, axial_x ** 3))
+        vertical_component = np.exp(- np.abs(axial_y))
+        weighted_measure = 0.9 * (0.4 * horizontal_component + 0.6 * vertical_component)
+
+        disp = arrays.disp(arrays.bbox_centroid, I, J)
+        dist = np.linalg.norm(disp, axis=-1)
+        size_a, size_b = arrays.pairs(arrays.size, I, J)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cos = disp[..., 0] / dist
+            extr_component = np.exp(- 0.1 * (1 - cos)) * np.exp(- 0.05 * dist / np.maximum(size_a, size_b))
+        return np.where(axial_x <= 0, 0.0, np.fmax(weighted_measure, extr_component))
+
+    def in_front_of_deic(self, I, J):
+        arrays = self.arrays
+        bbox = self.projections()
+        center = np.stack([(bbox[:, 0] + bbox[:, 1]) / 2, (bbox[:, 2] + bbox[:, 3]) / 2], axis=1)
+        size_2d = np.linalg.norm(np.stack([bbox[:, 1] - bbox[:, 0], bbox[:, 3] - bbox[:, 2]], axis=1), axis=1) / 2
+        dist = np.linalg.norm(arrays.disp(center, I, J), axis=-1)
+        size_a, size_b = arrays.pairs(size_2d, I, J)
+        scaled_proj_dist = dist / (np.maximum(size_a, size_b) + 0.001)
+        observer_dist = np.linalg.norm(arrays.location - self.world.observer.location, axis=1)
+        dist_a, dist_b = arrays.pairs(observer_dist, I, J)
+        return 0.5 * (batch_sigmoid(dist_b - dist_a, 1, 0.5) + np.exp(- 0.5 * scaled_proj_dist))
+
+    def in_front_of_extr(self, I, J):
+        arrays = self.arrays
+        centroid_dist = np.linalg.norm(arrays.disp(arrays.bbox_centroid, I, J), axis=-1)
+        radius_a, radius_b = arrays.pairs(arrays.radius, I, J)
+        centroid_dist_scaled = centroid_dist / (radius_a + radius_b + 0.0001)
+        disp = - arrays.disp(arrays.centroid, I, J)
+        return np.exp(- 0.01 * centroid_dist_scaled) * batch_within_cone(disp, -self.world.front_axis, 0.7)
+
+    def in_front_of(self, I, J):
+        ret_val = np.maximum(self.in_front_of_deic(I, J), self.in_front_of_extr(I, J))
+        return np.where(I[:, None] == J[None, :], 0.0, ret_val)
+
+    #==========================================================================================
+    #Ternary relations, computed over a vector of figures and an array of pairs of referents
+
+    def between(self, F, P):
+        """Vectorized version of spatial.between over the figures F and the pairs P."""
+        arrays = self.arrays
+        center = arrays.bbox_centroid
+        center_a = center[F][:, None, :]
+        center_b = center[P[:, 0]][None, :, :]
+        center_c = center[P[:, 1]][None, :, :]
+        vec1 = center_b - center_a
+        vec2 = center_c - center_a
+        cos = np.sum(vec1 * vec2, axis=-1) / (np.linalg.norm(vec1, axis=-1) * np.linalg.norm(vec2, axis=-1) + 0.001)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scaled_dist = np.linalg.norm(center[P[:, 0]] - center[P[:, 1]], axis=1)[None, :] / (2 * arrays.size[F])[:, None]
+        dist_coeff = np.exp(-0.05 * scaled_dist)
+        return np.exp(- 0.5 * np.abs(-1 - cos)) * dist_coeff
+
+    #==========================================================================================
+    #Upper bounds on the pairwise relations
+
+    def gap(self, I, J):
+        """Return the distances between the bounding boxes of the entities."""
+        span = self.arrays.span
+        gaps = []
+        for axis in range(3):
+            min_a, min_b = self.arrays.pairs(span[:, 2 * axis], I, J)
+            max_a, max_b = self.arrays.pairs(span[:, 2 * axis + 1], I, J)
+            gaps.append(np.maximum(0, np.maximum(min_b - max_a, min_a - max_b)))
+        return np.sqrt(gaps[0] ** 2 + gaps[1] ** 2 + gaps[2] ** 2)
+
+    def touching_bound(self, I, J):
+        """
+        For non-planar entities with disjoint bounding boxes, the closest mesh distance is at least
+        the gap between the boxes, and no vertex of a can lie on a face of b when the gap exceeds
+        0.51 of the diagonal of b (see skip_far_touching), so touching is at most exp(- gap / (size + 0.01)).
+        """
+        arrays = self.arrays
+        gap = self.gap(I, J)
+        size_a, size_b = arrays.pairs(arrays.size, I, J)
+        diag_b = np.linalg.norm(arrays.dimensions[J], axis=1)[None, :]
+        planar_a, planar_b = arrays.pairs(arrays.planar, I, J)
+        bound = np.where(gap > 0.51 * diag_b, np.exp(- gap / (np.minimum(size_a, size_b) + 0.01)), 1.0)
+        return np.where(planar_a | planar_b, 1.0, bound)
+
+    def on_bound(self, I, J):
+        """
+        If b is not planar and has no surface entities, on(a, b) is either above(a, b)
+        or touching(a, b) * above(a, b), which is at most above(a, b).
+        """
+        entities = self.arrays.entities
+        plain = np.array([not self.arrays.planar[j] and len(entities[j].surface_entities) == 0 for j in J], dtype=bool)
+        return np.where(plain[None, :], self.block(spatial.above, I, J), 1.0)
+
+    def at_bound(self, I, J):
+        """at(a, b) is at_same_height(a, b) times touching(a, b) if it exceeds 0.9, and times near(a, b) otherwise."""
+        touching = self.touching_bound(I, J)
+        near = self.block(spatial.near, I, J)
+        same_height = self.block(spatial.at_same_height, I, J)
+        return same_height * np.where(touching > 0.9, np.maximum(touching, near), near)
+
+    #==========================================================================================
+    #Derived relations, computed from the full matrices of other relations
+
+    def near_raw(self):
+        raw_metric = np.exp(- 0.1 * self.matrix(spatial.near_raw_distance))
+        return raw_metric * (1 - raw_metric / self.frame_size())
+
+    def near(self):
+        arrays = self.arrays
+        N = arrays.N
+        if N < 3:
+            #Too few entities for the scene statistics, defer to the scalar version
+            return np.array([[spatial.near(a, b) for b in arrays.entities] for a in arrays.entities],
+                            dtype=float).reshape(N, N)
+
+        #The averages exclude both arguments of the pair, as in spatial.near
+        raw = self.matrix(spatial.near_raw)
+        row_sum = raw.sum(axis=1)
+        diag = np.diag(raw)
+        average_near_a = (row_sum[:, None] - diag[:, None] - raw) / (N - 2)
+        average_near_b = (row_sum[None, :] - diag[None, :] - raw.T) / (N - 2)
+        avg_near = 0.5 * (average_near_a + average_near_b)
+        near_measure = raw + (raw - avg_near) * np.minimum(raw, 1 - raw)
+        np.fill_diagonal(near_measure, 0)
+        return near_measure
+
+    def over(self):
+        return 0.5 * self.matrix(spatial.above) + 0.2 * self.matrix(spatial.get_proj_intersection) + \
+            0.3 * self.matrix(spatial.near)
+
+    #==========================================================================================
+    #Pairwise relations composed from the cached values
+
+    def at(self, a, b):
+        if a == b:
+            return 0
+        touching = self.value(spatial.touching, a, b)
+        same_height = self.value(spatial.at_same_height, a, b)
+        return same_height * touching if touching > 0.9 else same_height * self.value(spatial.near, a, b)
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+
+import spatial
+from entity import geometry_stamp
+
+
+class RelationMemo(object):
+    """
+    Bounded LRU cache of the values of the predicates evaluated by the constraint
+    solver, keyed by the predicate and the identities of its arguments.
+
+    The values are only valid for the geometry of the world they were computed
+    at: the cache is flushed when the world records a move, and also whenever
+    it finds that the geometry stamp of the world (see entity.geometry_stamp)
+    has changed, e.g., after Entity.move_to, or that the observer has moved,
+    which changes the values of the deictic relations.
+    """
+
+    def __init__(self, world, max_size=50000):
+        self.world = world
+        self.max_size = max_size
+        self.values = OrderedDict()
+        self.version = self.stamp()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, predicate, args, compute):
+        """Return the cached value of predicate(*args), calling compute() to get it on a miss."""
+        version = self.stamp()
+        if version != self.version:
+            self.clear()
+            self.version = version
+        key = (predicate,) + tuple(args)
+        try:
+            value = self.values[key]
+        except KeyError:
+            self.misses += 1
+            value = compute()
+            self.values[key] = value
+            if len(self.values) > self.max_size:
+                self.values.popitem(last=False)
+                self.evictions += 1
+            return value
+        except TypeError:
+            #Unhashable arguments are not cached
+            self.misses += 1
+            return compute()
+        self.hits += 1
+        self.values.move_to_end(key)
+        return value
+
+    def clear(self):
+        """Drop all the cached values, e.g., after some entities have moved."""
+        self.values.clear()
+        self.version = self.stamp()
+
+    def stamp(self):
+        """Return the geometry stamp of the world together with the pose of the observer."""
+        return geometry_stamp(self.world), spatial.observer_pose(self.world.get_observer())
+
+    def counters(self):
+        """Return the numbers of hits, misses and evictions and the current size of the cache."""
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self.values)}
@@ -0,0 +1,130 @@
+import json
+import numpy as np
+
+
+class SnapshotVertices(object):
+    """Vertex list of a snapshot mesh, supporting the parts of the bpy API used by Entity."""
+
+    def __init__(self, coords):
+        self.coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self.coords)
+
+    def foreach_get(self, attr, buffer):
+        if attr != 'co':
+            raise ValueError("Snapshot vertices only store the 'co' attribute")
+        buffer[:] = self.coords.ravel()
+
+
+class SnapshotPolygon(object):
+
+    def __init__(self, vertices):
+        self.vertices = tuple(vertices)
+
+
+class SnapshotMesh(object):
+    """Local-space mesh of a snapshot, shared by all the objects using it."""
+
+    def __init__(self, name, vertices, polygons):
+        self.name = name
+        self.vertices = SnapshotVertices(vertices)
+        self.polygons = [SnapshotPolygon(polygon) for polygon in polygons]
+
+
+class SnapshotObject(object):
+    """
+    Mesh object of a snapshot, standing in for bpy_types.Object: it has a name, a parent,
+    a mesh, a world transform and the custom properties (id, color_mod, main, etc.).
+    """
+
+    type = "MESH"
+
+    def __init__(self, name, data, matrix_world, location=None, properties=None, parent=None):
+        self.name = name
+        self.data = data
+        self.matrix_world = np.asarray(matrix_world, dtype=float)
+        self.location = np.asarray(location if location is not None else self.matrix_world[:3, 3], dtype=float)
+        self.properties = dict(properties) if properties is not None else {}
+        self.parent = parent
+
+    def get(self, key, default=None):
+        return self.properties.get(key, default)
+
+    def __getitem__(self, key):
+        return self.properties[key]
+
+    def __setitem__(self, key, value):
+        self.properties[key] = value
+
+
+class SnapshotScene(object):
+    """Scene of a snapshot: the list of its objects and the location of the camera."""
+
+    def __init__(self, objects, camera_location=None):
+        self.objects = list(objects)
+        self.camera_location = np.asarray(camera_location, dtype=float) if camera_location is not None else None
+
+    def get_object(self, name):
+        for ob in self.objects:
+            if ob.name == name:
+                return ob
+        return None
+
+
+def export_properties(ob):
+    """Return the JSON-serializable custom properties of a Blender object."""
+    properties = {}
+    for key in ob.keys():
+        value = ob[key]
+        if hasattr(value, 'to_list'):
+            value = value.to_list()
+        if isinstance(value, (str, int, float, list)):
+            properties[key] = value
+    return properties
+
+
+def export_snapshot(scene, path):
+    """
+    Write the mesh objects of a Blender scene into a snapshot file, which can
+    then be loaded without Blender by load_snapshot. Must be run inside Blender.
+    """
+    meshes = {}
+    objects = []
+    for ob in scene.objects:
+        if ob.type != "MESH":
+            continue
+        mesh = ob.data
+        if mesh.name not in meshes:
+            coords = np.empty(3 * len(mesh.vertices))
+            mesh.vertices.foreach_get('co', coords)
+            meshes[mesh.name] = {'vertices': coords.reshape(-1, 3).tolist(),
+                                 'polygons': [list(polygon.vertices) for polygon in mesh.polygons]}
+        objects.append({'name': ob.name,
+                        'parent': ob.parent.name if ob.parent is not None else None,
+                        'mesh': mesh.name,
+                        'matrix_world': np.array(ob.matrix_world).tolist(),
+                        'location': list(ob.location),
+                        'properties': export_properties(ob)})
+    camera = scene.objects.get("Camera")
+    snapshot = {'objects': objects,
+                'meshes': meshes,
+                'camera_location': list(camera.location) if camera is not None else None}
+    with open(path, 'w') as file:
+        json.dump(snapshot, file)
+
+
+def load_snapshot(path):
+    """Load a snapshot file written by export_snapshot and return its SnapshotScene."""
+    with open(path) as file:
+        snapshot = json.load(file)
+    meshes = {name: SnapshotMesh(name, mesh['vertices'], mesh['polygons'])
+              for name, mesh in snapshot['meshes'].items()}
+    objects = {}
+    for item in snapshot['objects']:
+        objects[item['name']] = SnapshotObject(item['name'], meshes[item['mesh']], item['matrix_world'],
+                                               item.get('location'), item.get('properties'))
+    for item in snapshot['objects']:
+        if item.get('parent') is not None:
+            objects[item['name']].parent = objects.get(item['parent'])
+    return SnapshotScene([objects[item['name']] for item in snapshot['objects']], snapshot.get('camera_location'))
@@ -2,9 +2,12 @@ import numpy as np
 import math
 from entity import Entity
 from geometry_utils import *
-from queue import Queue
-from mathutils import Vector
-import bpy_extras
+try:
+    from mathutils import Vector
+    import bpy_extras
+except ImportError:
+    #Running without Blender (see headless.py)
+    Vector = bpy_extras = None
 from functools import reduce
 import itertools
 #from main import *
@@ -167,15 +170,51 @@ def vp_project(entity, observer):
     #render_scale = world.scene.render.resolution_percentage / 100
     #render_size = (int(world.scene.render.resolution_x * render_scale), int(world.scene.render.resolution_y * render_scale),)
     #pixel_coords = [(round(point.x * render_size[0]),round(point.y * render_size[1]),) for point in co_2d]
-    pixel_coords = [(eye_projection(point, observer.up, observer.right, np.linalg.norm(observer.location), 2)) for point in entity.vertex_set]
-    return pixel_coords
+    if len(entity.vertex_set) == 0:
+        return []
+    pixel_coords = batch_eye_projection(entity.vertex_set, observer.up, observer.right, np.linalg.norm(observer.location), 2)
+    return [tuple(point) for point in pixel_coords]
+
+def observer_pose(observer):
+    """Return the pose of the observer, which the projections onto its visual plane depend on."""
+    return (tuple(observer.location), tuple(observer.up), tuple(observer.right))
+
+class ProjectionCache(object):
+    """
+    Cache of the projections of the entities onto the observer's visual plane.
+
+    For every entity it keeps the bounding box, the center and the size of the
+    projection, tagged with the geometry version of the entity they were
+    computed for. The whole cache is dropped when the observer's pose changes.
+    """
+
+    def __init__(self):
+        self.pose = None
+        self.projections = {}
+
+    def get(self, entity, observer):
+        """Return the bounding box, the center and the size of the projection of the entity."""
+        pose = observer_pose(observer)
+        if pose != self.pose:
+            self.pose = pose
+            self.projections = {}
+        version = getattr(entity, 'geometry_version', None)
+        cached = self.projections.get(entity)
+        if cached is not None and version is not None and cached[0] == version:
+            return cached[1]
+        bbox = get_2d_bbox(vp_project(entity, observer))
+        projection = (bbox, projection_bbox_center(bbox), get_2d_size(bbox))
+        self.projections[entity] = (version, projection)
+        return projection
+
+projection_cache = ProjectionCache()
 
 #==========================================================================================
-#Raw metric for the nearness relation
-#Doesn't take into account the nearness statistics in the scene
+#Distance used by the raw nearness metric, including the special cases
+#for planar, elongated and concave entities
 #Inputs: a, b - entities
-#Return value: real number from [0, 1], the raw nearness measure
-def near_raw(a, b):
+#Return value: real number
+def near_raw_distance(a, b):
     bbox_a = a.bbox
     bbox_b = b.bbox
     dist = dist_obj(a, b)
@@ -185,18 +224,27 @@ def near_raw(a, b):
     max_dim_b = max(bbox_b[7][0] - bbox_b[0][0],
                     bbox_b[7][1] - bbox_b[0][1],
                     bbox_b[7][2] - bbox_b[0][2])
-    if a.get('planar') is not None:
+    kind_a = a.shape.kind
+    kind_b = b.shape.kind
+    if kind_a == Shape.PLANAR:
         #print ("TEST", a.name, b.name)
         dist = min(dist, get_planar_distance_scaled(a, b))
-    elif b.get('planar') is not None:
+    elif kind_b == Shape.PLANAR:
         dist = min(dist, get_planar_distance_scaled(b, a))        
-    elif a.get('vertical_rod') is not None or a.get('horizontal_rod') is not None or a.get('rod') is not None:
+    elif kind_a == Shape.ROD:
         dist = min(dist, get_line_distance_scaled(a, b))
-    elif b.get('vertical_rod') is not None or b.get('horizontal_rod') is not None or b.get('rod') is not None:
+    elif kind_b == Shape.ROD:
         dist = min(dist, get_line_distance_scaled(b, a))
-    elif a.get('concave') is not None or b.get('concave') is not None:
+    elif kind_a == Shape.CONCAVE or kind_b == Shape.CONCAVE:
         dist = min(dist, closest_mesh_distance_scaled(a, b))
+    return dist
 
+#Raw metric for the nearness relation
+#Doesn't take into account the nearness statistics in the scene
+#Inputs: a, b - entities
+#Return value: real number from [0, 1], the raw nearness measure
+def near_raw(a, b):
+    dist = near_raw_distance(a, b)
     fr_size = get_frame_size(entities)
     raw_metric = math.e ** (- 0.1 * dist)
     '''0.5 * (1 - min(1, dist / avg_dist + 0.01) +'''
@@ -207,41 +255,30 @@ entities = None
 #Computes the nearness measure for two entities
 #Takes into account the scene statistics:
 #The raw nearness score is updated depending on whether one object is the closest to another
+#For the entities of the world, the value is read from the near matrix of the relation engine
 #Inputs: a, b - entities
 #Return value: real number from [0, 1], the nearness measure
 def near(a, b):
-    #entities = get_entities()
-    #print (entities)
     if a == b:
         return 0
+    relations = getattr(world, 'relations', None)
+    if relations is not None:
+        arrays = relations.refresh()
+        #The engine defers to this function for scenes of fewer than three entities
+        if arrays.N >= 3 and a in arrays.index and b in arrays.index:
+            return relations.value(near, a, b)
     raw_near_a = []
     raw_near_b = []
     raw_near_measure = near_raw(a, b)
     for entity in entities:
         if entity != a and entity != b:
-            near_a_entity = near_raw(a, entity)
-            near_b_entity = near_raw(b, entity)
-            #print (entity.name, near_a_entity, near_b_entity)
-            #if dist_a_to_entity < raw_dist:
-            raw_near_a += [near_a_entity]
-            #if dist_b_to_entity < raw_dist:
-            raw_near_b += [near_b_entity]
-    #print ("RAW_NEAR_A: ", raw_near_a, entities)
-    #print ("RAW:", a.name, b.name, raw_near_measure)
+            raw_near_a += [near_raw(a, entity)]
+            raw_near_b += [near_raw(b, entity)]
     average_near_a = sum(raw_near_a) / len(raw_near_a)
     average_near_b = sum(raw_near_b) / len(raw_near_b)
     avg_near = 0.5 * (average_near_a + average_near_b)
-    max_near_a = max(raw_near_a)
-    max_near_b = max(raw_near_b)
-    max_near = max(raw_near_measure, max_near_a, max_near_b)
-    #print ("AVER: ", average_near_a, average_near_b)
-    ratio = raw_near_measure / max_near
-    if (raw_near_measure < avg_near):
-        near_measure_final = 0.5 * raw_near_measure
-    else:        
-        near_measure_final = raw_near_measure * ratio
     near_measure = raw_near_measure + (raw_near_measure - avg_near) * min(raw_near_measure, 1 - raw_near_measure)
-    #print ("RAW: {}; NEAR: {}; FINAL: {}; AVER: {};".format(raw_near_measure, near_measure, near_measure_final, (average_near_a + average_near_b) / 2))
+    #print ("RAW: {}; NEAR: {}; AVER: {};".format(raw_near_measure, near_measure, avg_near))
     return near_measure
 
 #Computes the between relation (a is between b and c)
@@ -286,7 +323,14 @@ def larger_than(a, b):
                              + bbox_a[7][1] - bbox_a[0][1] \
                              + bbox_a[7][2] - bbox_a[0][2])))
 
+#Computes the degree to which a supports b, either directly or through other entities
+#For the entities of the world the value is read from the support graph
+#Inputs: a, b - entities
+#Return value: real number from [0, 1]
 def supporting(a, b):
+    graph = getattr(world, 'support_graph', None)
+    if graph is not None and graph.contains(a, b):
+        return graph.supporting(a, b)
     direct_support = touching(a, b) * above(b, a)
     indirect_support = 0
     a_h = a.centroid[2]
@@ -324,11 +368,9 @@ def on(a, b):
     #print ("ON {}, {}, {}".format(ret_val, get_proj_intersection(a, b), v_offset(a, b)))
     #ret_val = max(ret_val, 0.5 * (above(a, b) + touching(a, b)))
     #print ("ON {}".format(ret_val))
-    for ob in b.components:
-        ob_ent = Entity(ob)
-        if ob.get('working_surface') is not None or ob.get('planar') is not None:
-            ret_val = max(ret_val, 0.5 * (v_offset(a, ob_ent) + get_proj_intersection(a, ob_ent)))
-            ret_val = max(ret_val, 0.5 * (int(near(a, ob_ent) > 0.99) + larger_than(ob_ent, a)))
+    for ob_ent in b.surface_entities:
+        ret_val = max(ret_val, 0.5 * (v_offset(a, ob_ent) + get_proj_intersection(a, ob_ent)))
+        ret_val = max(ret_val, 0.5 * (int(near(a, ob_ent) > 0.99) + larger_than(ob_ent, a)))
     if b.get('planar') is not None and isVertical(b):
         ret_val = max(ret_val, math.exp(- 0.5 * get_planar_distance_scaled(a, b)))
     return ret_val
@@ -373,12 +415,10 @@ def in_front_of_deic(a, b):
     dist = get_distance_from_line(world.get_observer().centroid, b.centroid, a.centroid)
     #print ("{}, {}, CLOSER: {}, WC_DEIC: {}, WC_EXTR: {}, DIST: {}".format(a.name, b.name, closer_than(a, b, observer), within_cone(b.centroid - observer.centroid, a.centroid - observer.centroid, 0.95), within_cone(b.centroid - a.centroid, Vector((0, -1, 0)) - a.centroid, 0.8), e ** (- 0.1 * get_centroid_distance_scaled(a, b))))
     #print ("WITHIN CONE:")
-    a_bbox = get_2d_bbox(vp_project(a, world.get_observer()))
-    b_bbox = get_2d_bbox(vp_project(b, world.get_observer()))
-    a_center = projection_bbox_center(a_bbox)
-    b_center = projection_bbox_center(b_bbox)
+    a_bbox, a_center, a_size = projection_cache.get(a, world.get_observer())
+    b_bbox, b_center, b_size = projection_cache.get(b, world.get_observer())
     dist = np.linalg.norm(a_center - b_center)
-    scaled_proj_dist = dist / (max(get_2d_size(a_bbox), get_2d_size(b_bbox)) + 0.001)
+    scaled_proj_dist = dist / (max(a_size, b_size) + 0.001)
     #scaled_proj_dist = gaussian(scaled_proj_dist, 0, 1)
 
     #print ("BBOX :", a_bbox, b_bbox)
@@ -466,9 +506,9 @@ def touching(a, b):
     planar_dist = 1e9
     shared_volume = shared_volume_scaled(a, b)
     #print ("SHARED VOLUME:", shared_volume)
-    if b.get("planar") is not None:
+    if b.shape.kind == Shape.PLANAR:
         planar_dist = get_planar_distance_scaled(b, a)
-    elif a.get("planar") is not None:
+    elif a.shape.kind == Shape.PLANAR:
         planar_dist = get_planar_distance_scaled(a, b)        
     #print ("PLANAR DIST: ", planar_dist)    
     if get_centroid_distance_scaled(a, b) <= 1.5:
@@ -477,10 +517,11 @@ def touching(a, b):
     #print ("MESH DIST: ", mesh_dist)    
     mesh_dist = min(mesh_dist, planar_dist)
     #print ("MESH DIST: ", mesh_dist)
+    #The degree to which a vertex of a lies on a face of b only matters
+    #when it is above 0.95 and the bounding boxes do not intersect
     touch_face = 0
-    for face in b.faces:
-        for v in a.vertex_set:
-            touch_face = max(is_in_face(v, face), touch_face)
+    if shared_volume == 0:
+        touch_face = max_face_contact(a.vertex_set, b.face_arrays, 0.95)
     #print("MIN FACE DIST: ", min_face_dist)
     #print ("SHORTEST MESH DIST:" , mesh_dist)
     if shared_volume == 0:
@@ -518,8 +559,8 @@ def asym_inv_exp_left(x, cutoff, left, right):
 #Inputs: a, b - entities
 #Return value: real number from [0, 1]
 def to_the_right_of_deic(a, b):
-    a_bbox = get_2d_bbox(vp_project(a, world.get_observer()))
-    b_bbox = get_2d_bbox(vp_project(b, world.get_observer()))
+    a_bbox = projection_cache.get(a, world.get_observer())[0]
+    b_bbox = projection_cache.get(b, world.get_observer())[0]
     #print ("\n2d bbox: ", a_bbox,"\n", b_bbox, "\n")
     axial_dist = scaled_axial_distance(a_bbox, b_bbox)    
     #print ("AX_DIST:", axial_dist)
@@ -634,6 +675,9 @@ def facing(a, b):
 
 def clear(obj):
     """Return the degree to which the object obj is clear, i.e., has nothing on top."""
+    graph = getattr(world, 'support_graph', None)
+    if graph is not None and graph.contains(obj):
+        return graph.clear(obj)
     ent_on = [on(entity, obj) for entity in entities if entity is not obj]
     return 1 - max(ent_on)
 
@@ -674,14 +718,45 @@ def where(entity):
     entities = [ent for ent in world.active_context if ent.name != entity.name and ent.name != 'Table']
     entity_pairs = [(ent1, ent2) for (ent1, ent2) in list(itertools.combinations(world.active_context, r = 2)) if entity.name != ent1.name and entity.name != ent2.name and ent1.name != 'Table' and ent2.name != 'Table']
 
+    #Binary relations are read from the relation matrices of the world
+    def value(pred_func, a, b):
+        return world.relations.value(pred_func, a, b)
+
     def get_vals(pred_func):
         if pred_func != between:
-            val = [((entity, ent), pred_func(entity, ent)) for ent in entities]
+            val = [((entity, ent), value(pred_func, entity, ent)) for ent in entities]
         else:
             val = [((entity, ent1, ent2), between(entity, ent1, ent2)) for (ent1, ent2) in entity_pairs]
         val.sort(key = lambda x: x[1], reverse=True)
         return val[0]
 
+    #When the target and all the candidate referents are in the relation tables of the world,
+    #the scores of the target are a row of the table and the best competing figure for the
+    #chosen referent is the maximum of its column, so only one row and one column are evaluated
+    relations = world.relations
+    arrays = relations.refresh()
+    tabled = entity in arrays.index and all([ent in arrays.index for ent in entities])
+    columns = [arrays.index[ent] for ent in entities] if tabled else None
+
+    def get_scores(pred_func):
+        if pred_func != between and tabled and relations.supports(pred_func):
+            row = relations.block(pred_func, [arrays.index[entity]], columns)[0]
+            best = int(np.argmax(row))
+            column = relations.block(pred_func, columns, [columns[best]])[:, 0]
+            return ((entity, entities[best]), float(row[best])), float(np.max(column))
+        #For between, the scores of the target over all the pairs are computed at once,
+        #and so are the scores of all the figures for the best pair
+        if pred_func == between and tabled and len(entity_pairs) > 0:
+            pairs = [(arrays.index[ent1], arrays.index[ent2]) for (ent1, ent2) in entity_pairs]
+            row = relations.triples(between, [arrays.index[entity]], pairs)[0]
+            best = int(np.argmax(row))
+            column = relations.triples(between, columns, [pairs[best]])[:, 0]
+            return ((entity, *entity_pairs[best]), float(row[best])), float(np.max(column))
+        val = get_vals(pred_func)
+        other_best = max([value(pred_func, ent, val[0][1]) for ent in entities]) if pred_func != between else \
+                    max([pred_func(ent, val[0][1], val[0][2]) for ent in entities])
+        return val, other_best
+
     pred_list = [at, between, on, under, to_the_left_of_deic, to_the_right_of_deic, in_front_of_deic, behind]
     pred_to_str = {at: 'next_to.p', between: 'between.p', on: 'on_top_of.p', under: 'under.p', 
     to_the_left_of_deic: 'to_the_left_of.p', to_the_right_of_deic: 'to_the_right_of.p', in_front_of_deic: 'in_front_of.p',
@@ -692,9 +767,7 @@ def where(entity):
     ret_val = None
 
     for pred in pred_list:
-        val = get_vals(pred)
-        other_best = max([pred(ent, val[0][1]) for ent in entities]) if pred != between else \
-                    max([pred(ent, val[0][1], val[0][2]) for ent in entities])
+        val, other_best = get_scores(pred)
         #print (pred, val)
         #if val[1] > max_val and val[1] > other_best + 0.05:
         if val[1] > max_val and val[1] > other_best - 0.1:
@@ -807,40 +880,7 @@ def extract_contiguous(entities):
     if entities == []:
         return []
 
-    groups = []
-
-    #A flag marking if the given index has been processed and assigned a group.    
-    processed = [0] * len(entities)
-    
-    q = Queue()
-
-    for idx in range(len(entities)):
-
-        """
-        If the current entity has not been assigned to a group yet,
-        add it to the BFS queue and create a new group for it.
-        """        
-        if processed[idx] == 0:
-            q.put(idx)
-            processed[idx] = 1
-            current_group = [entities[idx]]
-
-            """
-            Perform a BFS to find all the entities reachable from the one
-            that originated the current group.
-            """            
-            while not q.empty():
-                curr_idx = q.get()                
-                for idx1 in range(len(entities)):
-                    #print (processed[idx1], entities[curr_idx], entities[idx1], touching(entities[curr_idx], entities[idx1]))
-                    if processed[idx1] == 0 and touching(entities[curr_idx], entities[idx1]) > 0.85:
-                        q.put(idx1)
-                        processed[idx1] = 1
-                        current_group.append(entities[idx1])
-
-            groups.append(current_group)
-
-    return groups
+    return world.contiguity.groups(list(entities))
 
 def get_region(region_type, region_mod, entity):
     x_max = entity.x_max
@@ -0,0 +1,113 @@
+import math
+import itertools
+import numpy as np
+
+from geometry_utils import span_distance
+
+
+class SpatialIndex(object):
+    """
+    Broad-phase index over the axis-aligned bounding boxes (spans) of entities.
+
+    The entities are binned into a uniform grid of cubic cells. Entities that
+    are much larger than a cell (e.g., the table, walls or the floor) are not
+    binned and are always treated as candidates. The index is updated
+    incrementally: only the entities whose geometry version has changed
+    since they were binned are moved between the cells.
+    """
+
+    def __init__(self, entities, cell_size=None):
+        self.entities = list(entities)
+        if cell_size is None:
+            dims = [max(entity.dimensions) for entity in self.entities]
+            cell_size = 2 * float(np.median(dims)) if len(dims) > 0 else 1.0
+        self.cell_size = max(cell_size, 1e-3)
+
+        #Maps the cell coordinates to the set of entities overlapping the cell
+        self.cells = {}
+
+        #Entities spanning too many cells to be binned
+        self.large = set()
+
+        #The span, the cells and the geometry version of each indexed entity
+        self.spans = {}
+        self.entity_cells = {}
+        self.geometry_version = {}
+
+        for entity in self.entities:
+            self.insert(entity)
+
+    def cell_range(self, span, margin=0):
+        """Return the ranges of the cell coordinates covered by the span expanded by the margin."""
+        return [range(int(math.floor((span[2 * axis] - margin) / self.cell_size)),
+                      int(math.floor((span[2 * axis + 1] + margin) / self.cell_size)) + 1)
+                for axis in range(3)]
+
+    def insert(self, entity):
+        """Add the entity to the index."""
+        span = list(entity.span)
+        self.spans[entity] = span
+        self.geometry_version[entity] = entity.geometry_version
+        ranges = self.cell_range(span)
+        if np.prod([len(rng) for rng in ranges]) > 64:
+            self.large.add(entity)
+            self.entity_cells[entity] = []
+            return
+        cells = list(itertools.product(*ranges))
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(entity)
+        self.entity_cells[entity] = cells
+
+    def remove(self, entity):
+        """Remove the entity from the index."""
+        for cell in self.entity_cells.pop(entity, []):
+            self.cells[cell].discard(entity)
+            if len(self.cells[cell]) == 0:
+                del self.cells[cell]
+        self.large.discard(entity)
+        self.spans.pop(entity, None)
+        self.geometry_version.pop(entity, None)
+
+    def update(self, entity):
+        """Re-bin the entity after its geometry has changed."""
+        self.remove(entity)
+        self.insert(entity)
+
+    def refresh(self):
+        """
+        Re-bin the entities whose geometry has been recomputed since they were indexed.
+
+        Returns the list of the re-binned entities.
+        """
+        moved = [entity for entity in self.entities if entity.geometry_version != self.geometry_version[entity]]
+        for entity in moved:
+            self.update(entity)
+        return moved
+
+    def candidates(self, entity, distance=0):
+        """Return the indexed entities, other than the given one, whose spans lie within the distance of its span."""
+        span = self.spans[entity] if entity in self.spans else list(entity.span)
+        result = set(self.large)
+        ranges = self.cell_range(span, distance)
+        if np.prod([len(rng) for rng in ranges]) > len(self.cells):
+            for members in self.cells.values():
+                result.update(members)
+        else:
+            for cell in itertools.product(*ranges):
+                result.update(self.cells.get(cell, ()))
+        result.discard(entity)
+        return [other for other in result if span_distance(span, self.spans[other]) <= distance]
+
+    def pairs(self, distance=0):
+        """
+        Return the list of pairs of indexed entities whose spans lie within
+        the distance of each other. With zero distance these are the pairs
+        of entities with overlapping or touching bounding boxes.
+        """
+        result = set()
+        order = {entity: idx for idx, entity in enumerate(self.entities)}
+        for entity in self.entities:
+            for other in self.candidates(entity, distance):
+                if order[entity] < order[other]:
+                    result.add((entity, other))
+        return sorted(result, key=lambda pair: (order[pair[0]], order[pair[1]]))
@@ -0,0 +1,79 @@
+import numpy as np
+
+import spatial
+from entity import geometry_stamp
+
+
+class SupportGraph(object):
+    """
+    Support structure of the scene, built once per version of the world.
+
+    The direct support of b by a is the product touching(a, b) * above(b, a).
+    The indirect support is the transitive max-min closure of the direct
+    support over intermediate entities lying between a and b in height,
+    which is exactly the value computed recursively by spatial.supporting,
+    but obtained by dynamic programming over the entities sorted by height.
+    """
+
+    def __init__(self, world):
+        self.world = world
+        self.version = None
+        self.entities = []
+        self.index = {}
+        self.direct = None
+        self.support = None
+        self.clear_values = {}
+
+    def refresh(self):
+        """Rebuild the graph if the world has changed since it was built."""
+        if self.support is None or self.version != geometry_stamp(self.world):
+            self.build()
+        return self
+
+    def build(self):
+        relations = self.world.relations
+        arrays = relations.refresh()
+        self.entities = arrays.entities
+        self.index = arrays.index
+        self.version = geometry_stamp(self.world)
+        self.clear_values = {}
+
+        #direct[a, b] = touching(a, b) * above(b, a)
+        self.direct = relations.matrix(spatial.touching) * relations.matrix(spatial.above).T
+
+        height = arrays.centroid[:, 2]
+        size = arrays.size
+        support = self.direct.copy()
+
+        #Every intermediate entity e of the pair (a, b) is strictly higher than a
+        #and strictly lower than b, so processing the columns from the lowest b up
+        #and, within a column, the rows from the highest a down guarantees that
+        #support[a, e] and support[e, b] are final by the time they are needed.
+        order = np.argsort(height, kind='stable')
+        for b in order:
+            below_b = (height[b] - height) / size[b] >= 0.8
+            for a in order[::-1]:
+                between = below_b & ((height - height[a]) / size[a] >= 0.8)
+                if between.any():
+                    indirect = np.max(np.minimum(support[a, between], support[between, b]))
+                    support[a, b] = max(self.direct[a, b], indirect)
+        self.support = support
+
+    def contains(self, *args):
+        """Check whether all the arguments are entities of the graph."""
+        self.refresh()
+        return all(arg in self.index for arg in args)
+
+    def supporting(self, a, b):
+        """Return the degree to which a supports b, directly or through a stack of entities."""
+        self.refresh()
+        return float(self.support[self.index[a], self.index[b]])
+
+    def clear(self, obj):
+        """Return the degree to which obj has nothing on top of it."""
+        self.refresh()
+        if obj not in self.clear_values:
+            relations = self.world.relations
+            self.clear_values[obj] = 1 - max([relations.value(spatial.on, entity, obj)
+                                              for entity in self.entities if entity is not obj])
+        return self.clear_values[obj]
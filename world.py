@@ -12,6 +12,12 @@ from mathutils import Vector
 from mathutils import Quaternion
 from entity import Entity
 from geometry_utils import *
+from relation_engine import RelationEngine
+from support_graph import SupportGraph
+from spatial_index import SpatialIndex
+from contiguity import ContiguityGraph
+from entity_table import EntityTable
+from relation_memo import RelationMemo
 
 #import spatial
 
@@ -50,6 +56,11 @@ class World(object):
 
 		self.verbose = False
 		self.verbose_rotation = False
+
+		#Incremented every time the geometry of the world changes. Consumers
+		#caching derived data compare it against the version they have seen
+		#and use Entity.geometry_version to find out which entities changed.
+		self.version = 0
 		
 		bpy.utils.register_class(self.ProcessInputOp)
 		bpy.utils.register_class(self.ModalTimerOp)
@@ -71,6 +82,24 @@ class World(object):
 		self.dimensions = self.get_dimensions()		
 		self.observer = self.create_observer()
 
+		#Struct-of-arrays table of the geometric attributes of the entities
+		self.table = EntityTable(self.entities)
+
+		#Broad-phase index over the bounding boxes of the entities
+		self.spatial_index = SpatialIndex(self.entities)
+
+		#Batched evaluator of the spatial relations over the entities
+		self.relations = RelationEngine(self)
+
+		#Direct and indirect support between the entities
+		self.support_graph = SupportGraph(self)
+
+		#Contacts between the entities and their contiguous groups
+		self.contiguity = ContiguityGraph(self)
+
+		#Memoized values of the predicates evaluated by the constraint solver
+		self.memo = RelationMemo(self)
+
 		#Create and save the initial state of the world
 		self.history = []
 		self.move_queue = []
@@ -178,6 +207,7 @@ class World(object):
 		block['color_mod'] = material.name
 		block['main'] = 1.0
 		bpy.context.evaluated_depsgraph_get().update()
+		Entity.hierarchy.update()
 		return block      
 
 	def clear_scene(self):
@@ -330,6 +360,12 @@ class World(object):
 		for ent in self.entities:
 			if ent.name in moved_blocks:
 				ent.update()
+		if len(moved_blocks) > 0:
+			self.version += 1
+			#Re-bin the moved blocks and recompute the relation values involving them
+			self.spatial_index.refresh()
+			self.relations.refresh()
+			self.memo.clear()
 		# for name in moved_blocks:
 		# 	ent = self.find_entity_by_name(name)
 		# 	# old_loc = ent.location                    
@@ -483,6 +519,10 @@ class World(object):
 				elif self.actual_move:
 					for ent in self.world.entities:
 						ent.update()
+					self.world.version += 1
+					self.world.spatial_index.refresh()
+					self.world.relations.refresh()
+					self.world.memo.clear()
 					self.world.record_history()					
 					ShowMessageBox('Move complete...')
 					self.actual_move = False
@@ -511,6 +551,7 @@ class World(object):
 
 	class State:
 		def __init__(self, entities):
+			self.entities = list(entities)
 			self.locations = {}
 			for ent in entities:
 				self.locations[ent.name] = np.round(ent.location, 3)
@@ -525,14 +566,22 @@ class World(object):
 					result.append([name, s.locations[name], self.locations[name]])
 			return result
 
-		def compute(self):
+		def compute(self, relations):
+			"""
+			Collect the relational facts holding in the state, reading
+			the relation values from the matrices of the given RelationEngine.
+			"""
+			import spatial
 			from constraint_solver import func_to_rel_map
-			relations = [spatial.to_the_left_of_deic, spatial.to_the_right_of_deic, spatial.near, spatial.at, spatial.between, spatial.on, spatial.in_front_of_deic]
-			for ent1 in self.entities:
-				for ent2 in self.entities:
-					if ent1 != ent2:
-						for rel in relations:
-							if rel != spatial.between:
-								val = rel(ent1, ent2)
-								if val > 0.7:
-									self.state_facts.append([func_to_rel_map[rel], ent1, ent2, val])
\ No newline at end of file
+			self.state_facts = []
+			predicates = [spatial.to_the_left_of_deic, spatial.to_the_right_of_deic, spatial.near, spatial.at, spatial.on, spatial.in_front_of_deic]
+			for rel in predicates:
+				mat = relations.matrix(rel)
+				index = relations.arrays.index
+				for ent1 in self.entities:
+					for ent2 in self.entities:
+						if ent1 != ent2 and ent1 in index and ent2 in index:
+							val = mat[index[ent1], index[ent2]]
+							if val > 0.7:
+								self.state_facts.append([func_to_rel_map[rel], ent1, ent2, val])
+			return self.state_facts
\ No newline at end of file